@@ -7,7 +7,7 @@ import argparse
 import traceback
 from lib.logger import LoggerFactory
 
-from lib.thresholds import InstanceThresholdMigrator, FileThresholdSet
+from lib.thresholds import InstanceThresholdMigrator, FileThresholdSet, ThresholdFilter
 from lib.kmrepository import KMRepository
 from lib.policy import PolicyFactory
 from lib.config import MigrateConfig, CacheRepositoryConfig, GenerateSolutionTemplateConfig, ckey, cdefault, Config
@@ -39,6 +39,26 @@ def parseArguments():
     migrateCmd.add_argument("--thresholdext", action="store", dest=ckey.thresholdExtension,
         help=f"If a directory was specified in the --thresholds parameters, only files with this extension will be loaded. The default value is \'{cdefault.thresholdExtension}\'.")
 
+    migrateCmd.add_argument("--agents", action="store", dest=ckey.agentFilter, nargs="+",
+        help=f"only migrate the thresholds of these agents. Agents can be given by name or by name and port and can contain wildcards, for example 'web*' or '*:3181'.")
+
+    migrateCmd.add_argument("--monitortypes", action="store", dest=ckey.monitorTypeFilter, nargs="+",
+        help=f"only migrate the thresholds of these monitor types.")
+
+    migrateCmd.add_argument("--severities", action="store", dest=ckey.severityFilter, nargs="+",
+        help=f"only migrate the thresholds of these severities, for example 'WARNING' or 'ALARM'. Filtered thresholds are skipped while the files are read.")
+
+    migrateCmd.add_argument("--loadworkers", action="store", dest=ckey.loadWorkers, type=int,
+        help=f"number of processes used to read the threshold files. The files are read in parallel and the thresholds are migrated in the order of " +
+            f"the files. The default is '{cdefault.loadWorkers}'.")
+
+    migrateCmd.add_argument("--thresholdcache", action="store", dest=ckey.thresholdCacheDir,
+        help=f"directory where the parsed threshold files are cached. When a threshold file did not change since the last run it is loaded from the cache instead of " +
+            f"being parsed again. The default is '{cdefault.thresholdCacheDir}'.")
+
+    migrateCmd.add_argument("--nothresholdcache", action="store_true", dest=ckey.noThresholdCache,
+        help=f"always parse the threshold files and don't use the threshold cache.")
+
     migrateCmd.add_argument("--pconfig", action="store", dest=ckey.pconfig, nargs="+",
         help=f"pconfig file that should be migrated to cma.")
 
@@ -79,8 +99,8 @@ def parseArguments():
         help=f"specifies the percentage of coverage to be exceeded for a base policy to be creates. The default is \'{cdefault.optimizeThreshold}\'.")
 
     migrateCmd.add_argument("--minagents", action="store", dest=ckey.minAgents, type=int,
-        help=f"specifies the minimum number of agents a base policy must cover. If the number of configurations in the base policy is below this number, "
-            f"no base policy will be created. The default is \'{cdefault.minAgents}\'.")
+        help=f"specifies the minimum number of agents a base policy must cover. Configuration sets covering less agents are skipped while searching "
+            f"for the base policy. The default is \'{cdefault.minAgents}\'.")
 
     migrateCmd.add_argument("--depth", action="store", dest=ckey.depth, type=int,
         help=f"specifies the maximum number of configurations a base policy will contain. The higher the number the more configuration combinations the optimizer is "
@@ -90,7 +110,40 @@ def parseArguments():
         help=f"specifies the number of worker threads the optimizer will span to find optimal base policies. The default is \'{cdefault.threads}\'.")
 
     migrateCmd.add_argument("--timeout", action="store", dest=ckey.timeout, type=int,
-        help=f"Number of minutes after which the optimizer should timeout even if it didn't find the optimal result. \'{cdefault.timeout}\'.")
+        help=f"Number of minutes after which the optimizer should timeout even if it didn't find the optimal result. The timeout applies to every agent group " +
+            f"and monitor type on its own, starting when its optimization starts, whatever --sliceworkers is set to. \'{cdefault.timeout}\'.")
+
+    migrateCmd.add_argument("--engine", action="store", dest=ckey.engine, choices=["pandas", "bitset"],
+        help=f"specifies how the optimizer evaluates configuration combinations. 'pandas' evaluates every combination on the configuration matrix, 'bitset' " +
+            f"packs every configuration into a bitset of agents once so that a combination is evaluated by and-ing the bitsets. The default is \'{cdefault.engine}\'.")
+
+    migrateCmd.add_argument("--backend", action="store", dest=ckey.backend, choices=["thread", "process"],
+        help=f"specifies how the optimizer runs its workers. 'thread' runs --threads worker threads in the current process, 'process' runs --threads worker " +
+            f"processes which makes use of all the cores of the machine. The default is \'{cdefault.backend}\'.")
+
+    migrateCmd.add_argument("--search", action="store", dest=ckey.search, choices=["exhaustive", "apriori", "greedy"],
+        help=f"specifies how the optimizer searches for the base configuration set. 'exhaustive' verifies every combination up to --depth configurations. 'apriori' " +
+            f"only extends configuration sets which still cover at least --minagents agents. This allows to use higher depths on large exports. 'greedy' grows the " +
+            f"best configuration sets one configuration at a time (see --beamwidth). It is fast but might not find the optimal result. The default is \'{cdefault.search}\'.")
+
+    migrateCmd.add_argument("--beamwidth", action="store", dest=ckey.beamWidth, type=int,
+        help=f"number of configuration sets the greedy search keeps after every step. The default is \'{cdefault.beamWidth}\'.")
+
+    migrateCmd.add_argument("--comparesearch", action="store_true", dest=ckey.compareSearch,
+        help=f"run the exhaustive search after the greedy search and log how far the greedy result is from the exact result.")
+
+    migrateCmd.add_argument("--sliceworkers", action="store", dest=ckey.sliceWorkers, type=int,
+        help=f"number of processes used to optimize the agent groups and monitor types in parallel. Every agent group and monitor type is optimized " +
+            f"independently, the biggest ones are started first. --timeout applies to every agent group and monitor type from the moment it is started. The default is \'{cdefault.sliceWorkers}\'.")
+
+    migrateCmd.add_argument("--progress", action="store", dest=ckey.progressInterval, type=int,
+        help=f"number of seconds between the progress lines the optimizer logs while searching. The progress line shows the number of combinations verified " +
+            f"per second, the share of the search space done and the best coverage found so far. The interval must be at least 1 second. The default is \'{cdefault.progressInterval}\'.")
+
+    migrateCmd.add_argument("--statefile", action="store", dest=ckey.stateFile,
+        help=f"file the optimizer keeps its state in between runs. Agent groups and monitor types whose agents did not change since the last run " +
+            f"reuse the stored configuration set instead of being optimized again. The optimizer logs which base policies stayed stable. The state is " +
+            f"ignored when --depth, --search, --beamwidth or --minagents changed. Searches stopped by --timeout are not reused.")
 
     migrateCmd.add_argument("--classic", action="store_true", dest=ckey.classic,
         help=f"Skip optimization phase while processing server instance thresholds and generate policies which will contain all the server thresholds for one attribute in "
@@ -176,28 +229,28 @@ def parseArguments():
     return parser.parse_args()
 
 
-def migrateCmd(repositoryDir, cacheDir, version, policyDir, tagsDir, thresholdFilenames, thresholdExtension, pconfig, agentGroup, beautify, optimzeThreshold, minAgents, depth, threads, timeout, agentInfo,
+def migrateCmd(repositoryDir, cacheDir, version, policyDir, tagsDir, thresholdFilenames, thresholdExtension, agentFilter, monitorTypeFilter, severityFilter, loadWorkers, thresholdCacheDir, pconfig, agentGroup, beautify, optimzeThreshold, minAgents, depth, threads, timeout, agentInfo, engine, backend, search, beamWidth, compareSearch, sliceWorkers, progressInterval, stateFile,
         force, classic, classicPrefix, tenantId, tenantName, shared, enabled, basePrecedence, agentPrecedence, thresholdPrecedence, owner, group):
 
     # get the repository
     kmRepository = KMRepository.get(repositoryDir, cacheDir, version)
 
     if thresholdFilenames != None:
-        # load the Threshold File
-        thresholdSet = FileThresholdSet(thresholdFilenames, thresholdExtension)
-        thresholdSet.load()
+        # the Threshold Files are read while the thresholds are migrated
+        thresholdFilter = ThresholdFilter(agentFilter, monitorTypeFilter, severityFilter) if agentFilter or monitorTypeFilter or severityFilter else None
+        thresholdSet = FileThresholdSet(thresholdFilenames, thresholdExtension, thresholdFilter, loadWorkers, thresholdCacheDir)
 
         # Migrate Thresholds
         instanceThresholdMigrator = InstanceThresholdMigrator(thresholdSet, kmRepository)
         agentConfigurations = instanceThresholdMigrator.migrate(force)
 
         # Generate Policies
-        policyFactory = PolicyFactory(agentGroup, tenantId, tenantName, shared, enabled, basePrecedence, agentPrecedence, thresholdPrecedence, owner, group, beautify, classic, classicPrefix, optimzeThreshold, minAgents, depth, threads, timeout, agentInfo)
-        (policies, tags) = policyFactory.generatePolicies(agentConfigurations)
+        policyFactory = PolicyFactory(agentGroup, tenantId, tenantName, shared, enabled, basePrecedence, agentPrecedence, thresholdPrecedence, owner, group, beautify, classic, classicPrefix, optimzeThreshold, minAgents, depth, threads, timeout, agentInfo, engine, backend, search, beamWidth, compareSearch, sliceWorkers, progressInterval, stateFile)
+        policies = policyFactory.generatePolicies(agentConfigurations)
 
-        # Write Policies to file
+        # Write Policies to file while they are generated
         PolicyFactory.savePolicies(policies, policyDir)
-        PolicyFactory.saveTags(tags, tagsDir)
+        PolicyFactory.saveTags(policyFactory.tags, tagsDir)
 
     if pconfig != None:
         logger.info(f"Processing rulesets ...")
@@ -211,12 +264,12 @@ def migrateCmd(repositoryDir, cacheDir, version, policyDir, tagsDir, thresholdFi
         logger.info(f"Found {len(rulesetConfigurations)} ruleset configurations.")
 
         # Generate Policies
-        policyFactory = PolicyFactory(agentGroup, tenantId, tenantName, shared, enabled, basePrecedence, agentPrecedence, thresholdPrecedence, owner, group, beautify, classic, classicPrefix, optimzeThreshold, minAgents, depth, threads, timeout, agentInfo)
-        (policies, tags) = policyFactory.generatePolicies(rulesetConfigurations)
+        policyFactory = PolicyFactory(agentGroup, tenantId, tenantName, shared, enabled, basePrecedence, agentPrecedence, thresholdPrecedence, owner, group, beautify, classic, classicPrefix, optimzeThreshold, minAgents, depth, threads, timeout, agentInfo, engine, backend, search, beamWidth, compareSearch, sliceWorkers, progressInterval, stateFile)
+        policies = policyFactory.generatePolicies(rulesetConfigurations)
 
-        # Write Policies to file
+        # Write Policies to file while they are generated
         PolicyFactory.savePolicies(policies, policyDir)
-        PolicyFactory.saveTags(tags, tagsDir)
+        PolicyFactory.saveTags(policyFactory.tags, tagsDir)
 
 def kmrepoCmd(repositoryDir, cacheDir, version):
     kmRepository = KMRepository(f"{repositoryDir}{os.path.sep}bmc_products{os.path.sep}kmfiles")
@@ -244,75 +297,90 @@ def save(args):
 version = "1.0.0"
 
 logger = LoggerFactory.getLogger(__name__)
-logger.info(f"{__file__} CMA Utility Version {version} (c) 2020 BMC Software Inc.")
-
-args = parseArguments()
-try: 
-    if args.cmd == None and args.load != None:
-        type = Config.getType(args.load)
-        if type == "MigrateConfig": args.cmd = "migrate"
-        elif type == "CacheRepositoryConfig": args.cmd = "kmrepo"
-        else:
-            raise Exception(f"Found unexpected type '{type}' in configuration file '{args.load}'.")
-
-    if args.save != None:
-        save(args)
-
-    elif args.cmd == "migrate":
-        config = MigrateConfig(args)
-        migrateCmd(config.repositoryDir,
-            config.cacheDir,
-            config.repositoryVersion,
-            config.policyDir,
-            config.tagsDir,
-            config.thresholds,
-            config.thresholdExtension,
-            config.pconfig,
-            config.agentGroup,
-            config.beautify,
-            config.optimizeThreshold,
-            config.minAgents,
-            config.depth,
-            config.threads,
-            config.timeout,
-            config.agentInfo,
-            config.force,
-            config.classic,
-            config.classicPrefix,
-            config.tenantId,
-            config.tenantName,
-            config.shared,
-            config.enabled,
-            config.basePrecedence,
-            config.agentPrecedence,
-            config.thresholdPrecedence,
-            config.owner,
-            config.group)
-
-    elif args.cmd == "cache":
-        config = CacheRepositoryConfig(args)
-        kmrepoCmd(config.repositoryDir, config.cacheDir, config.repositoryVersion)
-
-    elif args.cmd == "solution":
-        config = GenerateSolutionTemplateConfig(args)
-        generateSolutionTemplateCmd(config.repositoryDir, config.cacheDir, config.repositoryVersion, config.monitor)
-
-
-    else: logger.error(f"Unknown command '{args.cmd}' used in command line.")
-
-
-except RuntimeError as error:
-    logger.error(error)
-    logger.debug(traceback.format_exc())
-
-except RuntimeWarning as warning:
-    logger.warning(warning)
-    logger.debug(traceback.format_exc())
-
-except Exception as exception:
-    logger.error(f"An unexpected error occured during execution.")
-    logger.error(exception)
-    logger.error(traceback.format_exc())
-
-finally:
-    logger.info("done.")
\ No newline at end of file
+# worker processes of the optimizer import this module again, so only run the command in the main process
+if __name__ == "__main__":
+    logger.info(f"{__file__} CMA Utility Version {version} (c) 2020 BMC Software Inc.")
+
+    args = parseArguments()
+    try: 
+        if args.cmd == None and args.load != None:
+            type = Config.getType(args.load)
+            if type == "MigrateConfig": args.cmd = "migrate"
+            elif type == "CacheRepositoryConfig": args.cmd = "kmrepo"
+            else:
+                raise Exception(f"Found unexpected type '{type}' in configuration file '{args.load}'.")
+
+        if args.save != None:
+            save(args)
+
+        elif args.cmd == "migrate":
+            config = MigrateConfig(args)
+            migrateCmd(config.repositoryDir,
+                config.cacheDir,
+                config.repositoryVersion,
+                config.policyDir,
+                config.tagsDir,
+                config.thresholds,
+                config.thresholdExtension,
+                config.agentFilter,
+                config.monitorTypeFilter,
+                config.severityFilter,
+                config.loadWorkers,
+                None if config.noThresholdCache else config.thresholdCacheDir,
+                config.pconfig,
+                config.agentGroup,
+                config.beautify,
+                config.optimizeThreshold,
+                config.minAgents,
+                config.depth,
+                config.threads,
+                config.timeout,
+                config.agentInfo,
+                config.engine,
+                config.backend,
+                config.search,
+                config.beamWidth,
+                config.compareSearch,
+                config.sliceWorkers,
+                config.progressInterval,
+                config.stateFile,
+                config.force,
+                config.classic,
+                config.classicPrefix,
+                config.tenantId,
+                config.tenantName,
+                config.shared,
+                config.enabled,
+                config.basePrecedence,
+                config.agentPrecedence,
+                config.thresholdPrecedence,
+                config.owner,
+                config.group)
+
+        elif args.cmd == "cache":
+            config = CacheRepositoryConfig(args)
+            kmrepoCmd(config.repositoryDir, config.cacheDir, config.repositoryVersion)
+
+        elif args.cmd == "solution":
+            config = GenerateSolutionTemplateConfig(args)
+            generateSolutionTemplateCmd(config.repositoryDir, config.cacheDir, config.repositoryVersion, config.monitor)
+
+
+        else: logger.error(f"Unknown command '{args.cmd}' used in command line.")
+
+
+    except RuntimeError as error:
+        logger.error(error)
+        logger.debug(traceback.format_exc())
+
+    except RuntimeWarning as warning:
+        logger.warning(warning)
+        logger.debug(traceback.format_exc())
+
+    except Exception as exception:
+        logger.error(f"An unexpected error occured during execution.")
+        logger.error(exception)
+        logger.error(traceback.format_exc())
+
+    finally:
+        logger.info("done.")
\ No newline at end of file
@@ -16,6 +16,20 @@ class CKey():
     depth = "depth"
     threads = "threads"
     timeout = "timeout"
+    engine = "engine"
+    backend = "backend"
+    search = "search"
+    beamWidth = "beamWidth"
+    compareSearch = "compareSearch"
+    sliceWorkers = "sliceWorkers"
+    progressInterval = "progressInterval"
+    stateFile = "stateFile"
+    agentFilter = "agentFilter"
+    monitorTypeFilter = "monitorTypeFilter"
+    severityFilter = "severityFilter"
+    loadWorkers = "loadWorkers"
+    thresholdCacheDir = "thresholdCacheDir"
+    noThresholdCache = "noThresholdCache"
     agentInfo = "agentInfo"
     classic = "classic"
     classicPrefix = "classicPrefix"
@@ -53,6 +67,20 @@ class CDefault():
     depth = 2
     threads = 8
     timeout = 10
+    engine = "pandas"
+    backend = "thread"
+    search = "exhaustive"
+    beamWidth = 5
+    compareSearch = False
+    sliceWorkers = 1
+    progressInterval = 10
+    stateFile = None
+    agentFilter = None
+    monitorTypeFilter = None
+    severityFilter = None
+    loadWorkers = 1
+    thresholdCacheDir = f"out{os.path.sep}thresholdcache"
+    noThresholdCache = False
     agentInfo = None
     classic = False
     classicPrefix = 1
@@ -131,7 +159,10 @@ class Config():
 class MigrateConfig(Config):
     keys = [ckey.repositoryDir, ckey.cacheDir, ckey.repositoryVersion, ckey.policyDir, ckey.tagsDir, ckey.agentGroup, ckey.beautify, ckey.optimizeThreshold, ckey.thresholds,
         ckey.pconfig, ckey.tenantId, ckey.tenantName, ckey.basePrecedence, ckey.agentPrecedence, ckey.shared, ckey.enabled, ckey.owner, ckey.group, ckey.agentInfo,
-        ckey.force, ckey.minAgents, ckey.depth, ckey.threads, ckey.classic, ckey.classicPrefix, ckey.thresholdPrecedence, ckey.timeout, ckey.thresholdExtension]
+        ckey.force, ckey.minAgents, ckey.depth, ckey.threads, ckey.classic, ckey.classicPrefix, ckey.thresholdPrecedence, ckey.timeout, ckey.thresholdExtension,
+        ckey.engine, ckey.backend, ckey.search, ckey.beamWidth, ckey.compareSearch, ckey.sliceWorkers,
+        ckey.progressInterval, ckey.stateFile, ckey.agentFilter, ckey.monitorTypeFilter, ckey.severityFilter, ckey.loadWorkers,
+        ckey.thresholdCacheDir, ckey.noThresholdCache]
 
     def __init__(self, args):
         super().__init__(args)
@@ -1,6 +1,9 @@
 import json
+import hashlib
+import weakref
 
 from lib.logger import LoggerFactory
+from lib.policybuilder import PolicyBuilder
 
 logger = LoggerFactory.getLogger(__name__)
 
@@ -15,18 +18,59 @@ class AgentConfiguration():
         self.attribute = attribute
 
         self.config = {}
+        self.digest = None
 
     def __eq__(self, other):
-        return self.config == other.config and self.solution == other.solution and self.release == other.release and self.monitorType == other.monitorType and self.attribute == other.attribute
+        return self.fingerprint() == other.fingerprint()
 
     def __hash__(self):
-        return hash(json.dumps(self.config, sort_keys=True))
+        return hash(self.fingerprint())
+
+    def fingerprint(self):
+        # Once the configuration is frozen the fingerprint is only computed once.
+        if self.digest != None: return self.digest
+
+        return fingerprint(self.solution, self.release, self.monitorType, self.attribute, self.config)
+
+    def freeze(self):
+        # the configuration can't be changed after it was frozen
+        self.digest = self.fingerprint()
+        self.config = FrozenConfig.create(self.config)
+
+    def isFrozen(self):
+        return self.digest != None
+
+def fingerprint(solution, release, monitorType, attribute, config):
+    # digest of the canonical representation of the solution, release, monitor type, attribute and config
+    canonical = json.dumps([solution, release, monitorType, attribute, config], sort_keys=True)
+    return hashlib.blake2b(canonical.encode(), digest_size = 16).hexdigest()
+
+class FrozenConfig(dict):
+    # a config which can't be changed anymore
+    @staticmethod
+    def create(config):
+        return FrozenConfig({key: FrozenConfig.create(value) if isinstance(value, dict) else value for key, value in config.items()})
+
+    def readonly(self, *args, **kwargs):
+        raise RuntimeError("Configuration can't be changed after it was frozen.")
+
+    __setitem__ = readonly
+    __delitem__ = readonly
+    clear = readonly
+    pop = readonly
+    popitem = readonly
+    setdefault = readonly
+    update = readonly
+
+    def __reduce__(self):
+        return (FrozenConfig, (dict(self),))
 
 class MonitoringConfiguration(AgentConfiguration):
-    def __init__(self, agent, port, solution, release, monitorType, profile, meta):
+    def __init__(self, agent, port, solution, release, monitorType, profile, meta, setters = None):
         super().__init__(agent, port, solution, release, monitorType, None)
         self.profile = profile
         self.meta = meta
+        self.setters = setters if setters != None else {}
 
         self.config = self.init(meta["configuration"])
 
@@ -41,24 +85,45 @@ class MonitoringConfiguration(AgentConfiguration):
         return config        
 
     def set(self, path, value):
-        metaCursor = self.meta["configuration"]
+        if self.isFrozen():
+            raise RuntimeError(f"trying to set '{path}' for monitor '{self.monitorType}' of agent '{self.agent}' after the configuration was frozen.")
+
+        # paths are compiled once per monitor type
+        setter = self.setters.get(path)
+        if setter == None:
+            setter = self.compile(path)
+            self.setters[path] = setter
+
         configCursor = self.config
+        for (segment, attributes) in setter.segments:
+            if attributes != None and not segment in configCursor:
+                configCursor[segment]=self.init(attributes)
+
+            configCursor = configCursor[segment]
+
+        if setter.type == "Boolean":
+            if not (value == "0" or value == "1"):
+                raise Exception(f"Value for path '{path}' of monitor '{self.monitorType} is of type {setter.type}. Value '{value}' Could not be set.'")
+
+        configCursor[setter.varname] = value
+
+    def compile(self, path):
+        metaCursor = self.meta["configuration"]
+        segments = []
 
         # Loop throu segments of path except for the last. Also skip the first since it is created by the initial "/"
         for segment in path.split("/")[1:-1]:
             if "type" in metaCursor and metaCursor["type"] == "List":
-                if not segment in configCursor:
-                    configCursor[segment]=self.init(metaCursor["attributes"])
-
-                configCursor = configCursor[segment]
+                # entries of lists are created when they are set the first time
+                segments.append((segment, metaCursor["attributes"]))
                 metaCursor = metaCursor["attributes"]
                 continue
 
             if not segment in metaCursor:
                 raise Exception(f"trying to set '{path}' for monitor '{self.monitorType}. Found '{segment}' was expection on of {', '.join([*metaCursor])}.")
 
+            segments.append((segment, None))
             metaCursor = metaCursor[segment]
-            configCursor = configCursor[segment]
 
         # get the varname and check if it is valid
         varname = path.split("/")[-1:][0]
@@ -75,53 +140,17 @@ class MonitoringConfiguration(AgentConfiguration):
         if type == "List":
             raise Exception(f"path '{path}' of monitor '{self.monitorType}' points to a list and to a configuration attribute.")
 
-        if type == "Boolean":
-            if not (value == "0" or value == "1"):
-                raise Exception(f"Value for path '{path}' of monitor '{self.monitorType} is of type {type}. Value '{value}' Could not be set.'")
-
-        configCursor[varname] = value
+        return PathSetter(segments, varname, type)
 
 
     def generate(self, policy, policyFactory):
-        # ensure that policy has monitorConfiguration node 
-        if not "monitorConfiguration" in policy:
-            policy["monitorConfiguration"] = {
-                "configurations": []
-            }
+        builder = policy if isinstance(policy, PolicyBuilder) else PolicyBuilder(policy)
 
-        # find and create the profile for this monitoring configuration
-        profile = None
-        for item in policy["monitorConfiguration"]["configurations"]:
-            if item["monitoringProfile"] == self.profile:
-                profile = item
-                break
-
-        if profile == None:
-            profile = {
-                "defaultMonitoring": False,
-                "monitoringProfile": self.profile,
-                "solutionName": self.solution,
-                "solutionVersion": self.release,
-                "monitors": []
-            }
-            policy["monitorConfiguration"]["configurations"].append(profile)
-
-        # find and create the monitor for this monitoring configuration
-        monitor = None
-        for item in profile["monitors"]:
-            if item["monitorType"] == self.monitorType:
-                monitor = item
-                break
-
-        if monitor == None:
-            monitor = {
-                "monitorType": self.monitorType,
-                "configuration": []
-            }
-            profile["monitors"].append(monitor)
+        # find and create the profile and the monitor for this monitoring configuration
+        monitor = builder.profileMonitor(self.profile, self.solution, self.release, self.monitorType)
 
         # generate the configuration entries
-        monitor["configuration"].extend(self.generateAttributeSet(self.meta["configuration"], self.config, "", policy, policyFactory))
+        monitor["configuration"].extend(self.generateAttributeSet(self.meta["configuration"], self.config, "", builder.policy, policyFactory))
 
     def generateAttributeSet(self, meta, attributeSet, path, policy, policyFactory):
         config = []
@@ -168,86 +197,75 @@ class MonitoringConfiguration(AgentConfiguration):
         return config
 
 
+class InstanceThresholdPayload():
+    # the part of an instance threshold which is equal for all the agents having the threshold
+    __slots__ = ["solution", "release", "monitorType", "attribute", "config", "digest", "__weakref__"]
+
+    def __init__(self, solution, release, monitorType, attribute, config):
+        self.solution = solution
+        self.release = release
+        self.monitorType = monitorType
+        self.attribute = attribute
+        self.digest = fingerprint(solution, release, monitorType, attribute, config)
+        self.config = FrozenConfig.create(config)
+
 class InstanceThresholdConfiguration(AgentConfiguration):
+    # Thresholds are usually exported for many agents. Only agent, port and device are stored per agent, the rest
+    # is a payload shared by all the equal thresholds. The payload is frozen when it is created.
+    payloads = weakref.WeakValueDictionary()
+
     def __init__(self, agent, port, solution, release, monitorType, device, attribute, absoluteDeviation, autoClose, comparison,
             durationInMins, minimumSamplingWindow, outsideBaseline, percentDeviation, predict, severity, threshold, instanceName, matchDeviceName, type):
 
-        super().__init__(agent, port, solution, release, monitorType, attribute)
-
+        self.agent = agent
+        self.port = port
         self.device = device
 
-        # Details
-        self.config["absoluteDeviation"] = absoluteDeviation
-        self.config["autoClose"] = autoClose
-        self.config["comparison"] = comparison
-        self.config["durationInMins"] = durationInMins
-        self.config["minimumSamplingWindow"] = minimumSamplingWindow
-        self.config["outsideBaseline"] = outsideBaseline
-        self.config["percentDeviation"] = percentDeviation
-        self.config["predict"] = predict
-        self.config["severity"] = severity
-        self.config["threshold"] = threshold
-
-        self.config["instanceName"] = instanceName
-        self.config["matchDeviceName"] = matchDeviceName
-        self.config["type"] = type
-
-    def getId(self):
-        return f"{self.solution}-{self.monitorType}-{self.attribute}-{self.instanceName}"
-
-    def generate(self, policy, policyFactory, classic = False):
-        if not "serverThresholdConfiguration" in policy:
-            policy["serverThresholdConfiguration"] = {
-                "solutionThresholds": []
+        key = (solution, release, monitorType, attribute, absoluteDeviation, autoClose, comparison, durationInMins, minimumSamplingWindow,
+            outsideBaseline, percentDeviation, predict, severity, threshold, instanceName, matchDeviceName, type)
+
+        self.payload = InstanceThresholdConfiguration.payloads.get(key)
+        if self.payload == None:
+            # Details
+            config = {
+                "absoluteDeviation": absoluteDeviation,
+                "autoClose": autoClose,
+                "comparison": comparison,
+                "durationInMins": durationInMins,
+                "minimumSamplingWindow": minimumSamplingWindow,
+                "outsideBaseline": outsideBaseline,
+                "percentDeviation": percentDeviation,
+                "predict": predict,
+                "severity": severity,
+                "threshold": threshold,
+
+                "instanceName": instanceName,
+                "matchDeviceName": matchDeviceName,
+                "type": type
             }
 
-        # Generate solution
-        found = False
-        for solution in policy["serverThresholdConfiguration"]["solutionThresholds"]:
-            if solution["solutionName"] == self.solution and solution["solutionVersion"] == self.release:
-                found = True
-                break
-
-        if not found:
-            solution = {
-                "solutionName": self.solution,
-                "solutionVersion": self.release,
-                "monitors": [] 
-            }
+            self.payload = InstanceThresholdPayload(solution, release, monitorType, attribute, config)
+            InstanceThresholdConfiguration.payloads[key] = self.payload
 
-            policy["serverThresholdConfiguration"]["solutionThresholds"].append(solution)
+    solution = property(lambda self: self.payload.solution)
+    release = property(lambda self: self.payload.release)
+    monitorType = property(lambda self: self.payload.monitorType)
+    attribute = property(lambda self: self.payload.attribute)
+    config = property(lambda self: self.payload.config)
+    digest = property(lambda self: self.payload.digest)
 
-        # Generate monitor
-        found = False
-        for monitor in solution["monitors"]:
-            if monitor["monitorType"] == self.monitorType:
-                found = True
-                break
+    def freeze(self):
+        # the payload is frozen already
+        pass
 
-        if not found:
-            monitor = {
-                "monitorType": self.monitorType,
-                "attributes": []
-            }
+    def getId(self):
+        return f"{self.solution}-{self.monitorType}-{self.attribute}-{self.instanceName}"
 
-            solution["monitors"].append(monitor)
-
-        # Generate attribute
-        found = False
-        for attribute in monitor["attributes"]:
-            if attribute["attributeName"] == self.attribute:
-                found = True
-                break
-
-        if not found:
-            attribute = {
-                "active": -1,
-                "attributeName": self.attribute,
-                "regEx": False,
-                "thresholds": []
-            }
+    def generate(self, policy, policyFactory, classic = False):
+        builder = policy if isinstance(policy, PolicyBuilder) else PolicyBuilder(policy)
 
-            monitor["attributes"].append(attribute)
+        # find and create the solution, monitor and attribute
+        attribute = builder.thresholdAttribute(self.solution, self.release, self.monitorType, self.attribute)
 
         # Generate Threshold
         attribute["thresholds"].append({
@@ -268,11 +286,22 @@ class InstanceThresholdConfiguration(AgentConfiguration):
             "type": self.config["type"]
         })
 
+class PathSetter():
+    # a configuration path resolved against the monitor metadata. segments holds the segments of the path and the
+    # attributes of the list entry if the segment is the key of a list entry.
+    def __init__(self, segments, varname, type):
+        self.segments = segments
+        self.varname = varname
+        self.type = type
+
 class MonitoringConfigurationFactory():
     def __init__(self, kmRepository):
         self.kmRepository = kmRepository
 
+        # compiled path setters of every monitor type, shared by all the configurations of the monitor type
+        self.setters = {}
+
     def create(self, agent, port, monitorType, profile):
         meta = self.kmRepository.monitors[monitorType]
 
-        return MonitoringConfiguration(agent, port, meta["solution"], meta["release"], meta["monitorType"], profile, meta)
\ No newline at end of file
+        return MonitoringConfiguration(agent, port, meta["solution"], meta["release"], meta["monitorType"], profile, meta, self.setters.setdefault(monitorType, {}))
\ No newline at end of file
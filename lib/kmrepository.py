@@ -15,6 +15,7 @@ logger = LoggerFactory.getLogger(__name__)
 class KMRepository():
     def __init__(self, repositoryDir = None, cacheDir = None, version = None):
         self.monitors = {}
+        self.realNames = {}
         if repositoryDir != None:
             self.loadFile(repositoryDir)
         elif cacheDir != None:
@@ -70,6 +71,8 @@ class KMRepository():
                                     "active": elChild.attrib["active"] if "active" in elChild.attrib else None
                                 }
 
+                        self.indexParameters(monitor)
+
 
     def parseAttributeSet(self, node, set):
         for elChild in node.getchildren():
@@ -148,6 +151,10 @@ class KMRepository():
         with open(f"{cacheDir}{os.path.sep}{version}") as fp:
             self.monitors = json.load(fp)
 
+        # caches written by older versions don't contain the parameter index
+        for monitor in self.monitors.values():
+            if not "parameterIndex" in monitor: self.indexParameters(monitor)
+
     def save(self, path, filename):
         logger.info(f"Writing KM repsoitory to cache '{path}{os.path.sep}{filename}' ...")
         os.makedirs(path, exist_ok = True)
@@ -168,15 +175,24 @@ class KMRepository():
 
         return attribute
 
+    def indexParameters(self, monitor):
+        # case insensitive index of the parameter names. If names only differ in case the first one wins.
+        monitor["parameterIndex"] = {}
+        for name in monitor["parameters"]:
+            monitor["parameterIndex"].setdefault(name.lower(), name)
+
     def getRealName(self, monitorType, parameter):
-        if not monitorType in self.monitors: raise RuntimeError(f"Monitor Type '{monitorType}' not found in repository.")
+        realName = self.realNames.get((monitorType, parameter))
+        if realName != None: return realName
 
-        p1 = parameter.lower()
+        if not monitorType in self.monitors: raise RuntimeError(f"Monitor Type '{monitorType}' not found in repository.")
 
-        for p2 in self.monitors[monitorType]["parameters"]:
-            if p1 == p2.lower(): return p2
+        realName = self.monitors[monitorType]["parameterIndex"].get(parameter.lower())
+        if realName == None:
+            raise RuntimeError(f"Parameter '{parameter} for monitor type {monitorType} not found in repository.")
 
-        raise RuntimeError(f"Parameter '{parameter} for monitor type {monitorType} not found in repository.")
+        self.realNames[(monitorType, parameter)] = realName
+        return realName
 
     @staticmethod
     def get(repositorydir = None, cachedir = None, version = None):
@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+#-----------------------
+# Configuration Matrix
+#-----------------------
+class ConfigurationMatrix():
+    # The matrix has the unique configurations as rows and the agents as columns. Only the cells which are set are
+    # stored, row by row (CSR): the agent columns of row i are indices[indptr[i]:indptr[i + 1]].
+    def __init__(self, configurations, agents, entryRows, entryColumns, header = None, agentAttributes = None):
+        self.configurations = configurations
+        self.agents = agents
+        self.header = header
+        self.agentAttributes = agentAttributes
+
+        self.solutions = np.array([configuration.solution for configuration in configurations], dtype = object)
+        self.monitorTypes = np.array([configuration.monitorType for configuration in configurations], dtype = object)
+
+        # sort the cells by row and column and drop duplicates
+        cells = np.unique(np.asarray(entryRows, dtype = np.int64) * max(len(agents), 1) + np.asarray(entryColumns, dtype = np.int64))
+
+        self.cellRows = (cells // max(len(agents), 1)).astype(np.int32)
+        self.indices = (cells % max(len(agents), 1)).astype(np.int32)
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(self.cellRows, minlength = len(configurations))))).astype(np.int64)
+
+        self.columnPtr = None
+        self.columnIndices = None
+
+        self.typeRows = None
+        self.typeCells = {}
+
+        self.attributeIndex = AgentAttributeIndex(header, agentAttributes) if header else None
+
+    def __len__(self):
+        return len(self.configurations)
+
+    def count(self):
+        return len(self.indices)
+
+    def monitorTypeRows(self):
+        # rows of every monitor type, in the order the monitor types were found
+        if self.typeRows is None:
+            (codes, monitorTypes) = pd.factorize(self.monitorTypes)
+            order = np.argsort(codes, kind = "stable")
+            bounds = np.cumsum(np.bincount(codes, minlength = len(monitorTypes)))[:-1]
+
+            self.typeRows = dict(zip(monitorTypes, np.split(order, bounds)))
+
+        return self.typeRows
+
+    def monitorTypeCells(self, monitorType):
+        # cells of all the rows of the monitor type. They are gathered once and shared by all the agent groups.
+        if not monitorType in self.typeCells:
+            self.typeCells[monitorType] = self.rowCells(self.monitorTypeRows()[monitorType])
+
+        return self.typeCells[monitorType]
+
+    def agentIds(self, id):
+        return self.indices[self.indptr[id]:self.indptr[id + 1]]
+
+    def configurationIds(self, column):
+        # build the column wise view on first use
+        if self.columnPtr is None:
+            order = np.argsort(self.indices, kind = "stable")
+            self.columnIndices = self.cellRows[order]
+            self.columnPtr = np.concatenate(([0], np.cumsum(np.bincount(self.indices, minlength = len(self.agents))))).astype(np.int64)
+
+        return self.columnIndices[self.columnPtr[column]:self.columnPtr[column + 1]]
+
+    def rowCells(self, rows):
+        # indices of the cells of the given rows, taken from the row ranges of the rows
+        rows = np.asarray(rows, dtype = np.int64)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    def select(self, rows, columns, cells = None):
+        # returns the indices of the cells which are part of the given rows and columns. If the cells of the rows are
+        # already known, only their columns are checked.
+        if cells is None: cells = self.rowCells(np.sort(rows))
+
+        columnMask = np.zeros(len(self.agents), dtype = bool)
+        columnMask[columns] = True
+
+        return cells[columnMask[self.indices[cells]]]
+
+    def rowCounts(self, rows, columns, cells = None):
+        # number of agents of the columns having the configuration for each of the rows
+        counts = np.bincount(self.cellRows[self.select(rows, columns, cells)], minlength = len(self.configurations))
+        return counts[rows]
+
+    def dense(self, rows, columns, cells = None):
+        rowPos = np.full(len(self.configurations), -1, dtype = np.int64)
+        rowPos[rows] = np.arange(len(rows))
+        columnPos = np.full(len(self.agents), -1, dtype = np.int64)
+        columnPos[columns] = np.arange(len(columns))
+
+        # the given cells may contain more rows than requested
+        cells = self.select(rows, columns, cells)
+        cells = cells[rowPos[self.cellRows[cells]] >= 0]
+
+        values = np.zeros((len(rows), len(columns)), dtype = bool)
+        values[rowPos[self.cellRows[cells]], columnPos[self.indices[cells]]] = True
+
+        return values
+
+    def cover(self, bases):
+        # Applies the base configuration sets in the given order. An agent is covered by a base if it has all the
+        # configurations of the base which are not covered by an earlier base yet. Returns a matrix telling which base
+        # covers which agent and the mask of the cells not covered by any of the bases.
+        remaining = np.ones(len(self.indices), dtype = bool)
+        covered = np.zeros((len(bases), len(self.agents)), dtype = bool)
+
+        for i, base in enumerate(bases):
+            ids = np.asarray(sorted(base), dtype = np.int64)
+            if len(ids) == 0: continue
+
+            # cells of the base configurations which are still uncovered
+            cells = self.rowCells(ids)
+            cells = cells[remaining[cells]]
+
+            covered[i] = np.bincount(self.indices[cells], minlength = len(self.agents)) == len(ids)
+            remaining[cells[covered[i][self.indices[cells]]]] = False
+
+        return covered, remaining
+
+    def toDataFrame(self):
+        # dense representation in the layout of the former configuration matrix, for use in the analytics notebooks
+        rows = np.arange(len(self.configurations))
+        columns = np.arange(len(self.agents))
+
+        dataFrame = pd.DataFrame(self.dense(rows, columns), index = rows, columns = self.agents)
+        dataFrame.insert(0, "_monitorType_", self.monitorTypes)
+        dataFrame.insert(0, "_solution_", self.solutions)
+
+        if self.header:
+            attributes = pd.DataFrame([info if info != None else [False] * len(self.header) for info in self.agentAttributes],
+                index = self.agents, columns = [f"_{attribute}_" for attribute in self.header]).T
+            attributes.insert(0, "_monitorType_", "")
+            attributes.insert(0, "_solution_", "")
+            dataFrame = pd.concat([attributes, dataFrame])
+
+        return dataFrame
+
+
+class AgentAttributeIndex():
+    # Every agent info attribute is stored as integer codes per agent column. Agents without agent information
+    # get the value False, so they form a group of their own.
+    def __init__(self, header, agentAttributes):
+        self.header = header
+        self.categories = []
+
+        codes = np.zeros((len(agentAttributes), len(header)), dtype = np.int64)
+        for i in range(len(header)):
+            values = [info[i] if info != None else False for info in agentAttributes]
+            # the agents without agent information come first, like they did when grouping with pandas
+            categories = sorted(set(values), key = lambda value: (value is not False, str(value)))
+            lookup = {value: code for code, value in enumerate(categories)}
+
+            codes[:, i] = [lookup[value] for value in values]
+            self.categories.append(categories)
+
+        self.codes = codes
+
+    def groups(self):
+        # returns the attribute values and the agent columns of every group, sorted by the attribute values
+        if len(self.codes) == 0: return []
+
+        (keys, groupOfColumn) = np.unique(self.codes, axis = 0, return_inverse = True)
+        groupOfColumn = groupOfColumn.reshape(-1)
+
+        order = np.argsort(groupOfColumn, kind = "stable")
+        bounds = np.cumsum(np.bincount(groupOfColumn, minlength = len(keys)))[:-1]
+
+        groups = []
+        for key, columns in zip(keys, np.split(order, bounds)):
+            groups.append(([self.categories[i][code] for i, code in enumerate(key)], columns))
+
+        return groups
@@ -1,165 +1,209 @@
 import pandas as pd
+import numpy as np
 import threading
-import queue
+import multiprocessing
 import time
 
-from itertools import combinations
+from itertools import combinations, chain, islice
+from math import comb
+from collections import deque
+from array import array
 
 from .logger import LoggerFactory
 
 from lib.agentinfo import AgentInfoFactory
+from lib.matrix import ConfigurationMatrix
+from lib.state import OptimizerState
 
 logger = LoggerFactory.getLogger(__name__)
 
+# Maximum memory used by the co-occurrence search of pairs. The slice is copied with 4 bytes for every configuration and
+# agent and the co-occurrence matrix holds 4 bytes for every pair of configurations (e.g. 5000 configurations and 8000
+# agents need 260 MB). Bigger slices use the streamed search.
+COOCCURRENCE_MEMORY = 256 * 1024 * 1024
+
 class PolicyOptimizer():
-    def __init__(self, agentInfo, minAgents, depth, threads, timeout):
+    def __init__(self, agentInfo, minAgents, depth, threads, timeout, engine = "pandas", backend = "thread", search = "exhaustive", beamWidth = 5, compareSearch = False, sliceWorkers = 1, progressInterval = 10, stateFile = None):
         self.agentInfo = AgentInfoFactory.getAgentInfo(agentInfo) if agentInfo != None else None
         self.minAgents = minAgents
         self.depth = depth
         self.threads = threads
         self.timeout = timeout
 
-        self.totalQuality = 0
-
-    def optimize2(self, agentConfigurations):
-        (c, configurations) = self.createConfigurationMatrix(agentConfigurations)
-
-        g = pd.DataFrame()
-        for attribute in self.agentInfo["header"]:
-            g[attribute] = c.loc[f"_{attribute}_"][2:]
-            
-        # loop through the groups
-        for name, group in g.groupby(self.agentInfo["header"]):
-            gc = self.filter(c, self.agentInfo["header"], list(name) if type(name) is tuple else [name])
-
-            logger.info(f"Optimizing agent group *** {name} ***")
+        if not engine in evaluators:
+            raise RuntimeError(f"Unknown optimizer engine '{engine}'. Use one of {', '.join(evaluators)}.")
+        self.engine = engine
 
-            # horizontal max
-            x = c[gc.iloc[:,2:].sum(axis=0).sort_values(ascending=False).index[0]]
+        if not backend in ["thread", "process"]:
+            raise RuntimeError(f"Unknown optimizer backend '{backend}'. Use one of thread, process.")
+        self.backend = backend
 
-            # vertical max
-            y = c[gc.sum(axis=0).sort_values(ascending=False).index[0]]
-            
-            # new matrix 
-            n = gc.loc[x[x == True]][y[y == True]]
+        if not search in ["exhaustive", "apriori", "greedy"]:
+            raise RuntimeError(f"Unknown optimizer search '{search}'. Use one of exhaustive, apriori, greedy.")
+        self.search = search
+        self.beamWidth = beamWidth
+        self.compareSearch = compareSearch
+        self.sliceWorkers = sliceWorkers
 
+        if progressInterval < 1:
+            raise RuntimeError(f"Invalid progress interval '{progressInterval}'. The progress interval must be at least 1 second.")
+        self.progressInterval = progressInterval
+        self.stateFile = stateFile
 
-            s=c[x]
-            s[s == True].index
+        self.totalQuality = 0
 
     def optimize(self, agentConfigurations, threshold):
         baseConfigs = {}
 
         (c, configurations) = self.createConfigurationMatrix(agentConfigurations)
 
-        if len(configurations) == 0 or len(c.columns) == 2:
+        if len(configurations) == 0 or len(c.agents) == 0:
             logger.warn("Nothing found to optimize.")
             return c, configurations, baseConfigs
 
+        # rows of the monitor types in the order they were found
+        monitorTypeRows = c.monitorTypeRows()
+
+        # every agent group and monitor type is an independent slice of the matrix
+        slices = []
         if self.agentInfo != None:
-            # generate the group by dataframe
-            g = pd.DataFrame()
-            for attribute in self.agentInfo["header"]:
-                g[attribute] = c.loc[f"_{attribute}_"][2:]
-            
-            # loop through the groups
-            for name, group in g.groupby(self.agentInfo["header"]):
-                gc = self.filter(c, self.agentInfo["header"], list(name) if type(name) is tuple else [name])
+            for values, columns in c.attributeIndex.groups():
+                name = values[0] if len(values) == 1 else tuple(values)
+                for monitorType, rows in monitorTypeRows.items():
+                    slices.append(("-".join([str(value) for value in values] + [monitorType]), name, monitorType, rows, columns))
+        else:
+            columns = np.arange(len(c.agents))
+            for monitorType, rows in monitorTypeRows.items():
+                slices.append((monitorType, None, monitorType, rows, columns))
 
+        # slices whose agents did not change since the last run reuse the stored search result
+        state = None
+        stored = {}
+        if self.stateFile != None:
+            (state, stored) = self.loadState(c, configurations, slices)
+
+        results = self.searchSlices(c, [slice for slice in slices if not slice[0] in stored])
+
+        group = None
+        for (idx, name, monitorType, rows, columns) in slices:
+            if name != None and name != group:
                 logger.info(f"Optimizing agent group *** {name} ***")
+                group = name
 
-                startColumn = gc.columns[2]
-                for monitorType in gc["_monitorType_"][len(self.agentInfo["header"]):].unique():
-                    matrix = gc.loc[gc._monitorType_==monitorType,startColumn:]
+            if idx in stored:
+                logger.info(f"***** {monitorType} *****")
+                logger.info(f"Agents unchanged since the last run. Reusing the stored configuration set.")
+                found = stored[idx]
+            else:
+                found = next(results)
 
-                    configIds = self.optimizeMatrix(matrix, monitorType, threshold)
-                    if configIds != None:
-                        idx = "-".join(list(name).append(monitorType)) if type(name) is tuple else f"{name}-{monitorType}"
-                        baseConfigs[idx] = configIds
-        else:
-            startColumn = c.columns[2]
-            for monitorType in c["_monitorType_"].unique():
-                matrix = c.loc[c._monitorType_==monitorType,startColumn:]
+            configIds = self.acceptSlice(found, monitorType, threshold)
+            if configIds != None:
+                baseConfigs[idx] = configIds
 
-                configIds = self.optimizeMatrix(matrix, monitorType, threshold)
-                if configIds != None:
-                    baseConfigs[monitorType] = configIds
+            if state != None:
+                state.setSlice(idx, found, configIds, configurations)
 
-        quality = self.totalQuality / ((c.iloc[:,2:].sum()).sum()) * 100
+        quality = self.totalQuality / c.count() * 100
         logger.info(f"Total coverage of base policies {'{:.2f}'.format(quality)}%.")
 
+        if state != None:
+            state.report()
+            state.save(self.stateFile)
+
         return c, configurations, baseConfigs
 
+    def loadState(self, matrix, configurations, slices):
+        state = OptimizerState.load(self.stateFile, type(configurations[0]).__name__, {"depth": self.depth, "search": self.search, "beamWidth": self.beamWidth, "minAgents": self.minAgents})
+        fingerprints = [configuration.fingerprint() for configuration in configurations]
 
-    def filter(self, matrix, attributes, values):
-        cols = []
-        i=0
-        for attribute in attributes:
-            # get the row of the attribute
-            s=matrix.loc[[f"_{attribute}_"],:].squeeze()[2:]
-            # add the list of columns 
-            cols.append(set(s[s == values[i]].index))
-            i = i + 1
+        state.update(OptimizerState.agentDigests(matrix, fingerprints))
 
-        c = ['_solution_', '_monitorType_']
-        c.extend(list(set.intersection(*cols)))
+        stored = {}
+        for (idx, name, monitorType, rows, columns) in slices:
+            signature = state.signature([matrix.agents[column] for column in columns], monitorType)
+            found = state.getSlice(idx, signature, fingerprints)
+            if found != False:
+                stored[idx] = found
 
-        return matrix[c]
+        logger.info(f"Reusing the stored results of {len(stored)} of {len(slices)} slice(s).")
 
+        return state, stored
 
-    def optimizeMatrix(self, matrix, name, threshold):
-        s = matrix.sum(axis = 1)
-        m = matrix.loc[list(s.loc[s > 1].index),:]
 
-        # sort the columns by occurence of true and remove columns that don't have any true value
-        sortedColumns = (m[m.columns.tolist()] == True).sum(axis = 0)
-        sortedColumns = sortedColumns.loc[sortedColumns > 0].sort_values(ascending = False).index.tolist()
+    def searchSlices(self, matrix, slices):
+        # yields the search results of the slices in the order of the slices
+        if self.sliceWorkers <= 1:
+            for (idx, name, monitorType, rows, columns) in slices:
+                yield self.searchSlice(matrix, rows, columns, monitorType, time.time() + self.timeout * 60, matrix.monitorTypeCells(monitorType))
 
-        logger.info(f"***** {name} *****")
-        logger.info(f"Found {len(sortedColumns)} relevant agent(s) and {len(matrix)} configuration(s) {len(m)} being relevant.")
-        if len(sortedColumns) == 0 or len(m) == 0: return None
+            return
 
-        allIds = set(m.index.tolist())
+        # like in the sequential search every slice gets --timeout from the moment it is started. The biggest slices are started first.
+        logger.info(f"Optimizing {len(slices)} slices using {self.sliceWorkers} processes ...")
 
-        q = Queue()
-        result = Result()
+        with multiprocessing.Pool(self.sliceWorkers, initializer = initSliceWorker, initargs = (self, matrix)) as pool:
+            pending = {}
+            for i in sorted(range(len(slices)), key = lambda i: -len(slices[i][3]) * len(slices[i][4])):
+                (idx, name, monitorType, rows, columns) = slices[i]
+                pending[i] = pool.apply_async(searchSlice, (rows, columns, monitorType))
 
-        c = 0
-        for i in range(1, min(len(allIds) + 1, self.depth + 1)):
-            for combination in combinations(allIds, i):
-                q.put(combination)
-                c = c + 1
-        
-        logger.info(f"Verifying {c} combinations ...")
-
-        # set the timer for the timeout
-        start = time.time()
-        
-        # start the worker threads
-        workers = []
-        for i in range(0,self.threads):
-            t = Worker(q, m, result)
-            t.start()
-            workers.append(t)
+            for i in range(len(slices)):
+                yield pending.pop(i).get()
 
-        # wait for worker threads to terminate
-        for worker in workers:
-            worker.join(10)
-            if worker.is_alive():
-                if  int(time.time()) - start > self.timeout * 60:
-                    logger.info(f"Stopping optimization since timout ({self.timeout} mins) was reached.")
-                    for w in workers:
-                        w.shutdown = True
+    def optimizeMatrix(self, matrix, rows, columns, name, threshold):
+        found = self.searchSlice(matrix, rows, columns, name, time.time() + self.timeout * 60)
+        return self.acceptSlice(found, name, threshold)
 
-                    break
+    def searchSlice(self, matrix, rows, columns, name, deadline, cells = None):
+        # the cells of the slice are selected once from the cells of its rows
+        cells = matrix.select(rows, columns, cells)
+
+        # only configurations applied to more than one agent are relevant
+        counts = matrix.rowCounts(rows, columns, cells)
+        relevantRows = rows[counts > 1]
+
+        # remove columns that don't have any true value
+        values = matrix.dense(relevantRows, columns, cells)
+        relevantColumns = values.any(axis = 0)
+        values = values[:, relevantColumns]
+
+        logger.info(f"***** {name} *****")
+        logger.info(f"Found {relevantColumns.sum()} relevant agent(s) and {len(rows)} configuration(s) {len(relevantRows)} being relevant.")
+        if relevantColumns.sum() == 0 or len(relevantRows) == 0: return None
+
+        allIds = relevantRows.tolist()
+
+        # build the evaluator once per matrix, it is shared by all the workers
+        evaluator = evaluators[self.engine](values, allIds)
 
+        depth = min(len(allIds), self.depth)
+        result = self.searchMatrix(self.search, values, allIds, depth, evaluator, deadline)
 
+        if self.compareSearch and self.search == "greedy":
+            exact = self.searchMatrix("exhaustive", values, allIds, depth, evaluator, deadline)
+            gap = (exact.maxCoverage - result.maxCoverage) / exact.maxCoverage * 100 if exact.maxCoverage > 0 else 0
+            logger.info(f"Greedy search coverage {result.maxCoverage}, exhaustive search coverage {exact.maxCoverage}. Greedy result is {'{:.2f}'.format(gap)}% below the exact result.")
+
+        # the result of a search stopped by the timeout is marked incomplete
         baseIds = result.baseIds
+        if baseIds == None:
+            return (None, 0, 0, result.complete)
+
+        agentIds = [id not in baseIds for id in allIds]
+        numagents = evaluator.count(baseIds)
+
+        return (baseIds, numagents, counts[counts > 1][agentIds].sum(), result.complete)
+
+    def acceptSlice(self, found, name, threshold):
+        if found == None: return None
 
-        agentIds = allIds - baseIds
-        numagents = m.loc[baseIds,:].all().value_counts()[True]
+        (baseIds, numagents, otherCount, complete) = found
+        if baseIds == None:
+            logger.info(f"No configuration set found. No base policy created.")
+            return None
 
-        quality = (len(baseIds) * numagents) / ((len(baseIds) * numagents) + (matrix.loc[agentIds,:].sum()).sum()) * 100
+        quality = (len(baseIds) * numagents) / ((len(baseIds) * numagents) + otherCount) * 100
         logger.info(f"Found optimal configuration set containing {len(baseIds)} configuration(s), covering {numagents} agent(s). Total coverage {'{:.2f}'.format(quality)}%.")
 
         self.totalQuality = self.totalQuality + (len(baseIds) * numagents)
@@ -168,23 +212,229 @@ class PolicyOptimizer():
             logger.info(f"No significant configuration set found ({quality} < {threshold}). No base policy created.")
             return None
 
-        return baseIds
+        # The searches return the configuration set as the combination in the order it was enumerated. The set is built
+        # here, so it iterates in the same order whichever search, backend or process found it.
+        return set(baseIds)
+
+    def searchMatrix(self, search, values, allIds, depth, evaluator, deadline):
+        result = Result()
+
+        if search == "apriori":
+            logger.info(f"Searching configuration sets supported by at least {self.minAgents} agent(s) ...")
+
+            self.searchApriori(allIds, depth, evaluator, result, deadline, Progress(None, result, self.progressInterval))
+
+        elif search == "greedy":
+            logger.info(f"Searching configuration sets with a beam width of {self.beamWidth} ...")
+
+            self.searchGreedy(allIds, depth, evaluator, result, deadline, Progress(None, result, self.progressInterval))
+
+        elif depth == 1 or (depth == 2 and 4 * len(allIds) * (len(allIds) + values.shape[1]) <= COOCCURRENCE_MEMORY):
+            logger.info(f"Computing co-occurrence of {len(allIds)} configurations supported by at least {self.minAgents} agent(s) ...")
+            self.searchCooccurrence(values, allIds, depth, result, deadline)
+
+        else:
+            q = CombinationQueue(allIds, depth)
+
+            c = sum(comb(len(allIds), i) for i in range(1, depth + 1))
+            logger.info(f"Verifying {c} combinations ...")
+
+            progress = Progress(c, result, self.progressInterval)
+            if self.backend == "process":
+                self.searchProcesses(q, evaluator, result, deadline, progress)
+            else:
+                self.searchThreads(q, evaluator, result, deadline, progress)
+
+        return result
+
+    def searchCooccurrence(self, values, allIds, depth, result, deadline):
+        # The number of agents a single configuration covers is the sum of its row, the number of agents a pair of
+        # configurations covers is the entry of the co-occurrence matrix C * C.T. The first maximum in row major
+        # order is kept, which is the order the exhaustive search enumerates the combinations in. Sets covering
+        # less than minAgents agents are not candidates.
+        counts = values.sum(axis = 1)
+        best = int(np.argmax(counts))
+        if counts[best] >= self.minAgents:
+            result.set(int(counts[best]), (allIds[best],))
+
+        if depth == 2:
+            matrix = values.astype(np.float32)
+            cooccurrence = matrix @ matrix.T
+
+            # the pairs are the entries above the diagonal. Every row is searched on its own, so the matrix isn't copied.
+            maxCount = 0
+            pair = None
+            for i in range(len(allIds) - 1):
+                if time.time() > deadline:
+                    self.stop(result)
+                    break
+
+                row = cooccurrence[i, i + 1:]
+                j = int(np.argmax(row))
+                if row[j] > maxCount and row[j] >= self.minAgents:
+                    maxCount = row[j]
+                    pair = (i, i + 1 + j)
+
+            if pair != None:
+                result.set(2 * int(maxCount), (allIds[pair[0]], allIds[pair[1]]))
+
+    def searchGreedy(self, allIds, depth, evaluator, result, deadline, progress):
+        # grow the best beamWidth configuration sets by one configuration at a time and keep the beamWidth
+        # sets with the highest coverage for the next round
+        beam = [()]
+        c = 0
+        for size in range(1, depth + 1):
+            candidates = {}
+            for combination in beam:
+                if time.time() > deadline:
+                    self.stop(result)
+                    return
+
+                for id in allIds:
+                    if id in combination: continue
+
+                    candidate = tuple(sorted(combination + (id,)))
+                    if candidate in candidates: continue
+
+                    # sets covering less than minAgents agents can't be extended to sets covering enough agents
+                    numagents = evaluator.count(candidate)
+                    candidates[candidate] = size * numagents if numagents >= self.minAgents else 0
+                    c = c + 1
+
+                progress.add(len(allIds))
+                progress.report()
+
+            beam = sorted([candidate for candidate in candidates if candidates[candidate] > 0], key = lambda candidate: (-candidates[candidate], candidate))[:self.beamWidth]
+            if len(beam) == 0: break
+
+            for candidate in beam:
+                result.set(candidates[candidate], candidate)
+
+        logger.info(f"Verified {c} combinations.")
+
+    def searchApriori(self, allIds, depth, evaluator, result, deadline, progress):
+        # Support can only shrink when a configuration set is extended, so every set covering less than minAgents
+        # agents is dropped before it is extended. Sets are extended in the same order the exhaustive search uses.
+        level = []
+        for id in allIds:
+            numagents = evaluator.count((id,))
+            if numagents >= self.minAgents:
+                level.append((id,))
+                result.set(numagents, (id,))
+
+        frequentIds = [combination[0] for combination in level]
+        c = len(allIds)
+
+        for size in range(2, depth + 1):
+            nextLevel = []
+            for combination in level:
+                if time.time() > deadline:
+                    self.stop(result)
+                    return
+
+                for id in frequentIds:
+                    if id <= combination[-1]: continue
+
+                    candidate = combination + (id,)
+                    numagents = evaluator.count(candidate)
+                    c = c + 1
+                    progress.add(1)
+
+                    if numagents >= self.minAgents:
+                        nextLevel.append(candidate)
+                        result.set(size * numagents, candidate)
+
+                progress.report()
+
+            logger.debug(f"Found {len(nextLevel)} configuration set(s) of size {size} covering at least {self.minAgents} agent(s).")
+            level = nextLevel
+            if len(level) == 0: break
+
+        logger.info(f"Verified {c} combinations.")
+
+    def searchThreads(self, q, evaluator, result, deadline, progress):
+        # start the worker threads
+        workers = []
+        for i in range(0,self.threads):
+            t = Worker(q, evaluator, result, deadline, progress, self.minAgents)
+            t.start()
+            workers.append(t)
+
+        # wait for worker threads to terminate. Wake up for the progress report and exactly at the deadline.
+        for worker in workers:
+            while worker.is_alive():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    if not q.shutdown:
+                        self.stop(result)
+
+                        # stop generating new combinations and tell the workers to stop
+                        q.close()
+                        for w in workers:
+                            w.shutdown = True
+
+                    worker.join()
+                    break
+
+                worker.join(min(remaining, self.progressInterval))
+                progress.report()
+
+        # the workers also stop on their own once the deadline passed
+        if not result.complete and not q.shutdown:
+            self.stop(result)
+
+    def searchProcesses(self, q, evaluator, result, deadline, progress):
+        # the evaluator is handed to every worker process once when the pool is created. Workers only
+        # receive chunks of combinations and return the best combination of the chunk. At the deadline the workers
+        # return the best combination found so far, so nothing evaluated before the deadline is lost.
+        with multiprocessing.Pool(self.threads, initializer = initProcessWorker, initargs = (evaluator, self.minAgents)) as pool:
+            pending = deque()
+            stopped = False
+            chunk = q.get()
+            while chunk != None or pending:
+                # don't hand out new chunks once the deadline has passed
+                if chunk != None and time.time() > deadline:
+                    stopped = True
+                    q.close()
+                    chunk = None
+                    continue
+
+                # keep a bounded number of chunks in flight
+                while chunk != None and len(pending) < self.threads * 2:
+                    pending.append(pool.apply_async(evaluateChunk, (chunk, deadline)))
+                    chunk = q.get()
+
+                # merge the results in the order the chunks were handed out
+                try:
+                    (coverage, baseIds, count, complete) = pending[0].get(self.progressInterval)
+                except multiprocessing.TimeoutError:
+                    progress.report()
+                    continue
+
+                pending.popleft()
+                if baseIds != None:
+                    result.set(coverage, baseIds)
+
+                if not complete: stopped = True
+
+                progress.add(count)
+                progress.report()
+
+        if stopped:
+            self.stop(result)
+
+    def stop(self, result):
+        result.complete = False
+        logger.info(f"Stopping optimization since timout ({self.timeout} mins) was reached. Using the best configuration set found so far (coverage {result.maxCoverage}).")
 
     def createConfigurationMatrix(self, agentConfigurations):
         # build agent config matrix
         uniqueConfigurations = []
-        columns = {}
-        # columns['__configid__']={}
-        columns['_solution_']={}
-        columns['_monitorType_']={}
-
-        # set the cell for the agent info attribute to blank for special variables
-        if self.agentInfo:
-            for attribute in self.agentInfo["header"]:
-                columns['_solution_'][f"_{attribute}_"] = ""
-                columns['_monitorType_'][f"_{attribute}_"] = ""
-
-        agents = []
+        configurationIds = {}
+        agents = {}
+        agentAttributes = []
+        entryRows = array("l")
+        entryColumns = array("l")
 
         for agentConfiguration in agentConfigurations:
             agent = agentConfiguration.agent
@@ -192,37 +442,27 @@ class PolicyOptimizer():
 
             agentId = f"{agent}:{port}"
 
-            if not agentConfiguration in uniqueConfigurations:
+            # equal configurations share the id of the first one found
+            fingerprint = agentConfiguration.fingerprint()
+            index = configurationIds.get(fingerprint)
+            if index == None:
+                index = len(uniqueConfigurations)
+                configurationIds[fingerprint] = index
                 uniqueConfigurations.append(agentConfiguration)
-                
-                index = uniqueConfigurations.index(agentConfiguration)
-
-                # columns["__configid__"][index] = agentConfiguration.configuration.getId()
-                columns["_solution_"][index] = agentConfiguration.solution
-                columns["_monitorType_"][index] = agentConfiguration.monitorType
             
-            index = uniqueConfigurations.index(agentConfiguration)
-            
-            if not agentId in columns:
-                columns[agentId]={}
-                # fill the attribute row for the agent with the agentinfo attributes
+            if not agentId in agents:
+                agents[agentId] = len(agents)
+                # remember the agentinfo attributes of the agent
                 if self.agentInfo:
-                    info = self.agentInfo["data"][agent] if agent in self.agentInfo["data"] else None
-                    i = 0
-                    for attribute in self.agentInfo["header"]:
-                        columns[agentId][f"_{attribute}_"] = info[i] if info != None else None
-
-                        i = i + 1                   
+                    agentAttributes.append(self.agentInfo["data"][agent] if agent in self.agentInfo["data"] else None)
 
-            columns[agentId][index]=True
+            entryRows.append(index)
+            entryColumns.append(agents[agentId])
 
-        logger.info(f"Optimizing policies for {len(columns) - 2} agents and {len(uniqueConfigurations)} unique configurations. Using {self.threads} threads and a depth of {self.depth}.")
+        logger.info(f"Optimizing policies for {len(agents)} agents and {len(uniqueConfigurations)} unique configurations. Using {self.threads} threads and a depth of {self.depth}.")
 
-        configurationMatrix=pd.DataFrame()
-        for header in columns:
-            configurationMatrix[header]=pd.Series(columns[header])
-            
-        configurationMatrix = configurationMatrix.fillna(False)
+        configurationMatrix = ConfigurationMatrix(uniqueConfigurations, list(agents), entryRows, entryColumns,
+            self.agentInfo["header"] if self.agentInfo else None, agentAttributes if self.agentInfo else None)
 
         return configurationMatrix, uniqueConfigurations
 
@@ -230,6 +470,7 @@ class Result():
     def __init__(self):
         self.maxCoverage = 0
         self.baseIds = None
+        self.complete = True
         self.lock = threading.Lock()
 
     def set(self, maxCoverage, baseIds):
@@ -241,45 +482,169 @@ class Result():
         self.lock.release()
 
 
+class DataFrameEvaluator():
+    def __init__(self, values, ids):
+        self.matrix = pd.DataFrame(values, index = ids)
+
+    def count(self, combination):
+        m = self.matrix.loc[list(combination),:]
+        s = m.all()
+        c = s.value_counts()
+
+        return c[True] if True in c else 0
+
+
+class BitsetEvaluator():
+    def __init__(self, values, ids):
+        # pack every configuration row into an int with one bit per agent
+        packed = np.packbits(values, axis = 1, bitorder = "little")
+
+        self.rows = {}
+        for i, id in enumerate(ids):
+            self.rows[id] = int.from_bytes(packed[i].tobytes(), "little")
+
+    def count(self, combination):
+        ids = iter(combination)
+        bits = self.rows[next(ids)]
+        for id in ids:
+            bits = bits & self.rows[id]
+
+        return bin(bits).count("1")
+
+
+evaluators = {
+    "pandas": DataFrameEvaluator,
+    "bitset": BitsetEvaluator
+}
+
+
+sliceOptimizer = None
+sliceMatrix = None
+
+def initSliceWorker(optimizer, matrix):
+    global sliceOptimizer, sliceMatrix
+    sliceOptimizer = optimizer
+    sliceMatrix = matrix
+
+    # pool workers can't start processes of their own
+    sliceOptimizer.backend = "thread"
+
+def searchSlice(rows, columns, monitorType):
+    # the deadline is set when the worker starts the slice, not when the slice is queued
+    deadline = time.time() + sliceOptimizer.timeout * 60
+    return sliceOptimizer.searchSlice(sliceMatrix, rows, columns, monitorType, deadline, sliceMatrix.monitorTypeCells(monitorType))
+
+
+processEvaluator = None
+processMinAgents = 0
+
+def initProcessWorker(evaluator, minAgents):
+    global processEvaluator, processMinAgents
+    processEvaluator = evaluator
+    processMinAgents = minAgents
+
+def evaluateChunk(chunk, deadline):
+    # returns the best combination of the chunk, the number of combinations evaluated and whether the whole chunk
+    # was evaluated. Once the deadline passed the best combination found so far is returned.
+    maxCoverage = 0
+    baseIds = None
+    count = 0
+    for combination in chunk:
+        if time.time() > deadline:
+            return maxCoverage, baseIds, count, False
+
+        numagents = processEvaluator.count(combination)
+        count = count + 1
+        if numagents < processMinAgents: continue
+
+        coverage = len(combination) * numagents
+        if coverage > maxCoverage:
+            maxCoverage = coverage
+            baseIds = combination
+
+    return maxCoverage, baseIds, count, True
+
+
 class Worker(threading.Thread):
-    def __init__(self, queue, matrix, result):
+    def __init__(self, queue, evaluator, result, deadline, progress, minAgents):
         threading.Thread.__init__(self)
         self.queue = queue
-        self.matrix = matrix
+        self.evaluator = evaluator
         self.result = result
+        self.deadline = deadline
+        self.progress = progress
+        self.minAgents = minAgents
         self.shutdown = False
 
     def run(self):
-        combination = self.queue.get()
-        while not combination == None and not self.shutdown:
-            m = self.matrix.loc[list(combination),:]
-            s = m.all()
-            c = s.value_counts()
-            numagents = c[True] if True in c else 0
+        chunk = self.queue.get()
+        while not chunk == None and not self.shutdown:
+            count = 0
+            for combination in chunk:
+                # don't start new combinations once the deadline has passed
+                if self.shutdown or time.time() > self.deadline:
+                    self.shutdown = True
+                    self.result.complete = False
+                    break
 
-            coverage = len(combination) * numagents
-            self.result.set(coverage, set(combination))
+                numagents = self.evaluator.count(combination)
 
-            combination = self.queue.get()
+                # a chunk can take seconds with the pandas engine, so the progress is added while it is evaluated
+                count = count + 1
+                if count % 100 == 0: self.progress.add(100)
 
+                if numagents < self.minAgents: continue
 
-class Queue():
-    def __init__(self):
+                coverage = len(combination) * numagents
+                self.result.set(coverage, combination)
+
+            self.progress.add(count % 100)
+            chunk = self.queue.get()
+
+
+class Progress():
+    def __init__(self, total, result, interval):
+        self.total = total
+        self.result = result
+        self.interval = interval
+        self.count = 0
+        self.start = time.time()
+        self.last = self.start
         self.lock = threading.Lock()
-        self.queue = queue.Queue(0)
+
+    def add(self, count):
+        self.lock.acquire()
+        self.count = self.count + count
+        self.lock.release()
+
+    def report(self):
+        now = time.time()
+        if now - self.last < self.interval: return
+        self.last = now
+
+        # the clock may not have advanced since the start
+        rate = self.count / (now - self.start) if now > self.start else 0
+        done = f", {'{:.2f}'.format(self.count / self.total * 100)}% of the search space" if self.total else ""
+        logger.info(f"Verified {self.count} combinations ({'{:.0f}'.format(rate)}/s{done}). Best coverage so far {self.result.maxCoverage}.")
+
+
+class CombinationQueue():
+    def __init__(self, ids, depth, chunkSize = 1000):
+        self.lock = threading.Lock()
+        self.chunkSize = chunkSize
+        self.shutdown = False
+
+        # combinations are generated lazily while the workers are asking for them
+        self.combinations = chain.from_iterable(combinations(ids, i) for i in range(1, depth + 1))
 
     def get(self):
         self.lock.acquire()
-        if not self.queue.empty():
-            d = self.queue.get()
-            self.lock.release()
-            return d
+        chunk = list(islice(self.combinations, self.chunkSize)) if not self.shutdown else []
+        self.lock.release()
 
-        else:
-            self.lock.release()
-            return None
+        return chunk if chunk else None
 
-    def put(self, d):
+    def close(self):
         self.lock.acquire()
-        self.queue.put(d)
-        self.lock.release()
\ No newline at end of file
+        self.shutdown = True
+        self.lock.release()
@@ -2,11 +2,15 @@ import uuid
 import os
 import json
 import re
+import queue
+import threading
+import numpy as np
 
 from .logger import LoggerFactory
 from lib.agentinfo import AgentInfoFactory
 from lib.optimizer import PolicyOptimizer
 from lib.configuration import InstanceThresholdConfiguration
+from lib.policybuilder import PolicyBuilder
 
 logger = LoggerFactory.getLogger(__name__)
 
@@ -14,7 +18,7 @@ logger = LoggerFactory.getLogger(__name__)
 # Policies
 #-----------------------
 class PolicyFactory():
-    def __init__(self, agentGroup, tenantId, tenantName, shared, enabled, basePrecedence, agentPrecedence, thresholdPrecence, owner, group, beautify = False, classic = False, classicPrefix = 1, optimizeThreshold = 20, minAgents = 2, depth = 3, threads = 8, timeout = 10, agentInfo = None):
+    def __init__(self, agentGroup, tenantId, tenantName, shared, enabled, basePrecedence, agentPrecedence, thresholdPrecence, owner, group, beautify = False, classic = False, classicPrefix = 1, optimizeThreshold = 20, minAgents = 2, depth = 3, threads = 8, timeout = 10, agentInfo = None, engine = "pandas", backend = "thread", search = "exhaustive", beamWidth = 5, compareSearch = False, sliceWorkers = 1, progressInterval = 10, stateFile = None):
         self.agentGroup = agentGroup
         self.tenantId = tenantId
         self.tenantName = tenantName
@@ -30,10 +34,15 @@ class PolicyFactory():
         self.classicPrefix = classicPrefix
         self.optimizeThreshold = optimizeThreshold
 
-        self.optimizer = PolicyOptimizer(agentInfo, minAgents, depth, threads, timeout)
+        self.optimizer = PolicyOptimizer(agentInfo, minAgents, depth, threads, timeout, engine, backend, search, beamWidth, compareSearch, sliceWorkers, progressInterval, stateFile)
 
     def generatePolicies(self, agentConfigurations):
+        # Yields the policies while they are generated. The tags of the agents are collected in self.tags and are
+        # complete once all the policies were generated.
         logger.info("Generating policies ...")
+        policyCount = 0
+        self.tags = {}
+
         if self.classic:
             instanceThresholdConfigurations = []
             otherConfigurations = []
@@ -44,16 +53,18 @@ class PolicyFactory():
                 else:
                     otherConfigurations.append(configuration)
 
-            (policies, tags) = self.generatePoliciesClassic(agentConfigurations)
+            (policies, self.tags) = self.generatePoliciesClassic(agentConfigurations)
 
             thresholdCount = len(policies)
+            policyCount = len(policies)
+            yield from policies
 
             agentConfigurations = otherConfigurations
 
         else:
             thresholdCount = 0
-            policies = []
-            tags = {}
+
+        tags = self.tags
 
         baseCount = 0
         taggedCount = 0
@@ -71,44 +82,55 @@ class PolicyFactory():
             policy = self.createPolicy(f'TAG EQUALS "BASE-{id}"', policyName,
                 self.tenantId, self.tenantName, self.shared, self.enabled, self.basePrecedence, self.owner, self.group,
                 "Auto generated base policy")
-            policies.append(policy)
 
+            builder = PolicyBuilder(policy)
             for configId in configIds:
-                configurations[configId].generate(policy, self)
+                configurations[configId].generate(builder, self)
 
             baseCount = baseCount + 1
+            policyCount = policyCount + 1
+            yield policy
+
+        # apply the base configurations to all the agents at once and see which configurations are not covered
+        baseIds = list(baseConfigurations)
+        (covered, remaining) = configurationMatrix.cover([baseConfigurations[id] for id in baseIds])
 
-        # loop through configurations and see which ones are not covered by the base policies
-        for agentId in configurationMatrix.iloc[:,2:]:
-            agentConfigIds = set(configurationMatrix.loc[configurationMatrix[agentId] == True, agentId].index)
+        # add agents to tags
+        coveredBy = {}
+        for (column, base) in zip(*np.nonzero(covered.T)):
+            id = re.sub("_CONTAINER$", "", baseIds[base]) if self.beautify else baseIds[base]
+
+            agentId = configurationMatrix.agents[column]
+            if not agentId in tags: tags[agentId] = set()
+            tags[agentId].add(f"BASE-{id}")
 
-            # loop through base configs and see if they cover the agent
-            for id, baseConfigIds in baseConfigurations.items():
-                if self.beautify: id = re.sub("_CONTAINER$", "", id)
+            # the base configurations may be a list when they were restored from the optimizer state
+            coveredBy.setdefault(column, []).append(set(baseConfigurations[baseIds[base]]))
 
-                if baseConfigIds.issubset(agentConfigIds):
-                    agentConfigIds = agentConfigIds.difference(baseConfigIds)
+        # if an agent still has config ids we'll create an agent policy
+        uncovered = np.bincount(configurationMatrix.indices[remaining], minlength = len(configurationMatrix.agents))
+        for column in np.flatnonzero(uncovered).tolist():
+            agentId = configurationMatrix.agents[column]
 
-                    # add agents to tags
-                    if not agentId in tags: tags[agentId] = set()
-                    tags[agentId].add(f"BASE-{id}")
+            agentConfigIds = set(configurationMatrix.configurationIds(column).tolist())
+            for baseConfigIds in coveredBy.get(column, []):
+                agentConfigIds = agentConfigIds.difference(baseConfigIds)
 
-            # if we still have config ids we'll create an agent policy
-            if agentConfigIds:
-                (agent, port) = agentId.split(":")
-                policy = self.createPolicy(f'agentName EQUALS \"{agent}\" AND agentPort NUMBER_EQUALS \"{port}\"',
-                    f"HOST-{agent}-{port}",
-                    self.tenantId, self.tenantName, self.shared, self.enabled, self.agentPrecedence, self.owner, self.group,
-                    "Auto generated agent policy")
-                policies.append(policy)
-                for configId in agentConfigIds:
-                    configurations[configId].generate(policy, self)
+            (agent, port) = agentId.split(":")
+            policy = self.createPolicy(f'agentName EQUALS \"{agent}\" AND agentPort NUMBER_EQUALS \"{port}\"',
+                f"HOST-{agent}-{port}",
+                self.tenantId, self.tenantName, self.shared, self.enabled, self.agentPrecedence, self.owner, self.group,
+                "Auto generated agent policy")
 
-                agentCount = agentCount + 1
+            builder = PolicyBuilder(policy)
+            for configId in agentConfigIds:
+                configurations[configId].generate(builder, self)
 
+            agentCount = agentCount + 1
+            policyCount = policyCount + 1
+            yield policy
 
-        logger.info(f"Generated {len(policies)} policies. ({baseCount} base policies, {agentCount} agent policies, {thresholdCount} threshold policies, {len(tags)} tagged agents)")
-        return policies, tags
+        logger.info(f"Generated {policyCount} policies. ({baseCount} base policies, {agentCount} agent policies, {thresholdCount} threshold policies, {len(tags)} tagged agents)")
 
 
     def generatePoliciesClassic(self, instanceThresholdConfiguration):
@@ -126,9 +148,9 @@ class PolicyFactory():
 
             if not id in policies:
                 policyname =  f"THRESHOLD-{id}"
-                policies[id] = self.createPolicy(f'TAG EQUALS "THRESHOLD-{id}"', policyname,
+                policies[id] = PolicyBuilder(self.createPolicy(f'TAG EQUALS "THRESHOLD-{id}"', policyname,
                     self.tenantId, self.tenantName, self.shared, self.enabled, self.thresholdPrecedence, self.owner, self.group,
-                    "Auto generated threshold policy")
+                    "Auto generated threshold policy"))
                 count[id] = 0
 
             configuration.generate(policies[id], self, classic = True)
@@ -147,7 +169,7 @@ class PolicyFactory():
                 logger.warn(f"try to reduct the number of policies by increasing --classicprefix.")
                 
 
-        return list(policies.values()), tags
+        return [builder.policy for builder in policies.values()], tags
 
 
     def createPolicy(self, agentSelectionCriteria, name, tenantId, tenantName, shared, enabled, precedence, owner, group, description):
@@ -184,13 +206,41 @@ class PolicyFactory():
         return self.autoIndexMap[key][value]
 
     @staticmethod
-    def savePolicies(policies, path):
+    def savePolicies(policies, path, queueSize = 100):
+        # The policies are written by a writer thread while they are generated. The queue between the two is bounded,
+        # so only a few policies are held in memory at any time.
         logger.info(f"Writing policies to directory '{path}' ...")
         os.makedirs(path, exist_ok = True)
 
-        for policy in policies:
-            with open(f"{path}{os.path.sep}{policy['name']}.mo", 'w') as fp:
-                json.dump([policy], fp, indent = 4)
+        q = queue.Queue(queueSize)
+        errors = []
+        writer = threading.Thread(target = PolicyFactory.writePolicies, args = (q, path, errors))
+        writer.start()
+
+        try:
+            for policy in policies:
+                q.put(policy)
+        finally:
+            q.put(None)
+            writer.join()
+
+        if len(errors) > 0:
+            raise RuntimeError(f"An error occured while writing policies to directory '{path}'. ({errors[0]})")
+
+    @staticmethod
+    def writePolicies(q, path, errors):
+        while True:
+            policy = q.get()
+            if policy == None: break
+
+            # after an error the queue is still emptied, so the generation of the policies is not blocked
+            if len(errors) > 0: continue
+
+            try:
+                with open(f"{path}{os.path.sep}{policy['name']}.mo", 'w') as fp:
+                    json.dump([policy], fp, indent = 4)
+            except Exception as error:
+                errors.append(error)
 
     @staticmethod
     def saveTags(tags, path):
@@ -0,0 +1,108 @@
+#-----------------------
+# Policy Builder
+#-----------------------
+class PolicyBuilder():
+    # Builds the JSON document of a policy. The solution, monitor, attribute and profile nodes are indexed while they
+    # are created, so finding the node a configuration is added to does not depend on the size of the policy.
+    def __init__(self, policy):
+        self.policy = policy
+
+        self.solutions = {}
+        self.monitors = {}
+        self.attributes = {}
+        self.profiles = {}
+        self.profileMonitors = {}
+
+        # index the nodes the policy already has. The first node found wins, like it did when the nodes were searched.
+        if "serverThresholdConfiguration" in policy:
+            for solution in policy["serverThresholdConfiguration"]["solutionThresholds"]:
+                solutionKey = (solution["solutionName"], solution["solutionVersion"])
+                self.solutions.setdefault(solutionKey, solution)
+
+                for monitor in solution["monitors"]:
+                    self.monitors.setdefault((solutionKey, monitor["monitorType"]), monitor)
+
+                    for attribute in monitor["attributes"]:
+                        self.attributes.setdefault((solutionKey, monitor["monitorType"], attribute["attributeName"]), attribute)
+
+        if "monitorConfiguration" in policy:
+            for profile in policy["monitorConfiguration"]["configurations"]:
+                self.profiles.setdefault(profile["monitoringProfile"], profile)
+
+                for monitor in profile["monitors"]:
+                    self.profileMonitors.setdefault((profile["monitoringProfile"], monitor["monitorType"]), monitor)
+
+    def thresholdAttribute(self, solutionName, solutionVersion, monitorType, attributeName):
+        # returns the attribute node of the server thresholds, the node and its parents are created if needed
+        if not "serverThresholdConfiguration" in self.policy:
+            self.policy["serverThresholdConfiguration"] = {
+                "solutionThresholds": []
+            }
+
+        solutionKey = (solutionName, solutionVersion)
+        solution = self.solutions.get(solutionKey)
+        if solution == None:
+            solution = {
+                "solutionName": solutionName,
+                "solutionVersion": solutionVersion,
+                "monitors": []
+            }
+
+            self.policy["serverThresholdConfiguration"]["solutionThresholds"].append(solution)
+            self.solutions[solutionKey] = solution
+
+        monitor = self.monitors.get((solutionKey, monitorType))
+        if monitor == None:
+            monitor = {
+                "monitorType": monitorType,
+                "attributes": []
+            }
+
+            solution["monitors"].append(monitor)
+            self.monitors[(solutionKey, monitorType)] = monitor
+
+        attribute = self.attributes.get((solutionKey, monitorType, attributeName))
+        if attribute == None:
+            attribute = {
+                "active": -1,
+                "attributeName": attributeName,
+                "regEx": False,
+                "thresholds": []
+            }
+
+            monitor["attributes"].append(attribute)
+            self.attributes[(solutionKey, monitorType, attributeName)] = attribute
+
+        return attribute
+
+    def profileMonitor(self, monitoringProfile, solutionName, solutionVersion, monitorType):
+        # returns the monitor node of the monitoring profile, the node and the profile are created if needed
+        if not "monitorConfiguration" in self.policy:
+            self.policy["monitorConfiguration"] = {
+                "configurations": []
+            }
+
+        profile = self.profiles.get(monitoringProfile)
+        if profile == None:
+            profile = {
+                "defaultMonitoring": False,
+                "monitoringProfile": monitoringProfile,
+                "solutionName": solutionName,
+                "solutionVersion": solutionVersion,
+                "monitors": []
+            }
+
+            self.policy["monitorConfiguration"]["configurations"].append(profile)
+            self.profiles[monitoringProfile] = profile
+
+        monitor = self.profileMonitors.get((monitoringProfile, monitorType))
+        if monitor == None:
+            monitor = {
+                "monitorType": monitorType,
+                "configuration": []
+            }
+
+            profile["monitors"].append(monitor)
+            self.profileMonitors[(monitoringProfile, monitorType)] = monitor
+
+        return monitor
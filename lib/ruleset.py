@@ -2,11 +2,11 @@ import os
 import sys
 import shlex
 import re
-import codecs
 
 from lib.logger import LoggerFactory
 
 from lib.configuration import MonitoringConfiguration, MonitoringConfigurationFactory
+from lib.sources import Source, Sources
 
 
 logger = LoggerFactory.getLogger(__name__)
@@ -25,6 +25,10 @@ class RulesetMigrator():
             logger.debug(f"Migrating Ruleset '{ruleset.source}' ...")
             for rule in ruleset.rules:
                 self.migrateRule(rule, ruleset.agent, ruleset.port, configurationMap)
+
+            # all the rules of the agent are set
+            for configuration in configurationMap.values():
+                configuration.freeze()
             
             configurations.extend(list(configurationMap.values()))
 
@@ -72,6 +76,10 @@ class RulesetMigrator():
 
 class RuleSet():
     def __init__(self, filename):
+        # the ruleset is either read from a file or from a member of an archive
+        source = filename if isinstance(filename, Source) else Source(filename)
+        filename = str(source)
+
         logger.debug(f"Parsing Ruleset '{filename}' ...")
         self.rules = []
         self.source = filename
@@ -79,14 +87,15 @@ class RuleSet():
         search = f'([^{os.path.sep}]+)_([0-9]+)[^{os.path.sep}]*'
 
         # get agent and port from filename
-        match = re.match(re.compile(search), os.path.basename(os.path.splitext(filename)[0]))
+        match = re.match(re.compile(search), os.path.splitext(source.basename())[0])
         if not match:
             raise RuntimeError(f"Ruleset file '{filename}' does not match file naming convention.")
 
         self.agent = match[1]
         self.port = match[2]
 
-        with codecs.open(filename, 'r', encoding='utf-8', errors='ignore') as fdata:
+        # line endings are kept as they are in the file
+        with source.open(encoding='utf-8', errors='ignore', newline='') as fdata:
             content = fdata.read()
 
         lexer = shlex.shlex(content, posix=True)
@@ -157,23 +166,12 @@ def RuleSetFactory(files):
             logger.warn(f"Ruleset file '{file}' does not exist.")
             continue
 
-        if os.path.isfile(file):
+        for source in Sources(file):
             try:
-                rulesets.append(RuleSet(file))
+                rulesets.append(RuleSet(source))
             except RuntimeError as error:
                 logger.error(error)
             except RuntimeWarning as warning:
                 logger.warn(warning)
 
-        elif os.path.isdir(file):
-            for subdir, dirs, files in os.walk(file):
-                for filename in files:
-                    try:
-                        fullname = f"{subdir}{os.path.sep}{filename}"
-                        rulesets.append(RuleSet(fullname))
-                    except RuntimeError as error:
-                        logger.error(error)
-                    except RuntimeWarning as warning:
-                        logger.warn(warning)
-
     return rulesets
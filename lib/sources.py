@@ -0,0 +1,152 @@
+import os
+import re
+import io
+import gzip
+import tarfile
+import zipfile
+
+from contextlib import contextmanager
+
+from .logger import LoggerFactory
+
+logger = LoggerFactory.getLogger(__name__)
+
+#-----------------------
+# Sources
+#-----------------------
+class Source():
+    # A file to be read. The file is either a plain file or a member of a .zip, .tar, .tar.gz/.tgz or .gz archive
+    # which is read without extracting it to disk. Members found while reading an archive are opened through the
+    # archive which is already open, or from their content once they were read into memory.
+    def __init__(self, filename, archive = None, member = None, opener = None, data = None):
+        self.filename = filename
+        self.archive = archive
+        self.member = member
+        self.opener = opener
+        self.data = data
+
+    def __str__(self):
+        return self.filename
+
+    def stat(self):
+        # the archive changes whenever one of its members changes
+        return os.stat(self.archive if self.archive != None else self.filename)
+
+    def basename(self):
+        return os.path.basename(self.member if self.member != None else self.filename)
+
+    def detach(self):
+        # returns a source which can be handed to another process. The content of an archive member is read now,
+        # while the archive is still open.
+        if self.opener == None: return self
+
+        with self.openMember() as member:
+            return Source(self.filename, self.archive, self.member, data = member.read())
+
+    @contextmanager
+    def open(self, encoding = None, errors = None, newline = None):
+        if self.archive == None:
+            with open(self.filename, encoding = encoding, errors = errors, newline = newline) as fp:
+                yield fp
+
+        else:
+            with self.openMember() as member:
+                yield io.TextIOWrapper(member, encoding = encoding, errors = errors, newline = newline)
+
+    @contextmanager
+    def openMember(self):
+        if self.data != None:
+            yield io.BytesIO(self.data)
+
+        elif self.opener != None:
+            with self.opener() as member:
+                yield member
+
+        elif isZip(self.archive):
+            with zipfile.ZipFile(self.archive) as archive, archive.open(self.member) as member:
+                yield member
+
+        elif isTar(self.archive):
+            with tarfile.open(self.archive) as archive, archive.extractfile(self.member) as member:
+                yield member
+
+        else:
+            with gzip.open(self.archive) as member:
+                yield member
+
+
+class StreamMember(io.RawIOBase):
+    # A member of a tar archive read as a stream. The member can't tell whether it is seekable, which is asked
+    # when it is read as text.
+    def __init__(self, member):
+        self.member = member
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.member.readinto(buffer)
+
+    def close(self):
+        self.member.close()
+        super().close()
+
+
+def isZip(filename):
+    return filename.lower().endswith(".zip")
+
+def isTar(filename):
+    return re.search(r"\.(tar|tar\.gz|tgz)$", filename.lower()) != None
+
+def isGzip(filename):
+    return filename.lower().endswith(".gz") and not isTar(filename)
+
+def isArchive(filename):
+    return isZip(filename) or isTar(filename) or isGzip(filename)
+
+def archiveSources(filename, pattern = None):
+    # Members of the archive. If a pattern is given only members with a matching name are returned. The archive is
+    # opened once and a member can only be read until the next member is returned.
+    if isGzip(filename):
+        member = os.path.basename(filename)[:-3]
+        if pattern == None or re.match(pattern, member):
+            yield Source(filename, filename, member)
+
+        return
+
+    logger.info(f"Reading files from archive '{filename}' ...")
+    if isZip(filename):
+        with zipfile.ZipFile(filename) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and (pattern == None or re.match(pattern, os.path.basename(info.filename))):
+                    yield Source(f"{filename}{os.path.sep}{info.filename}", filename, info.filename, lambda info = info: archive.open(info))
+
+    else:
+        # the tar archive is read as a stream, so a compressed archive is decompressed once
+        with tarfile.open(filename, mode = "r|*") as archive:
+            for info in archive:
+                if info.isfile() and (pattern == None or re.match(pattern, os.path.basename(info.name))):
+                    yield Source(f"{filename}{os.path.sep}{info.name}", filename, info.name, lambda info = info: io.BufferedReader(StreamMember(archive.extractfile(info))))
+
+def Sources(path, pattern = None):
+    # Returns the sources of a path. A file is always returned and an archive is opened. The files of a directory are
+    # returned if they match the pattern. Archives found in a directory are only opened if their name matches the
+    # pattern as well (e.g. export.csv.gz), so a directory holding an archive and its extracted files is read once.
+    # Without a pattern archives in a directory are never opened.
+    if os.path.isfile(path):
+        if isArchive(path):
+            yield from archiveSources(path, pattern)
+        else:
+            yield Source(path)
+
+    elif os.path.isdir(path):
+        for subdir, dirs, files in os.walk(path):
+            for f in files:
+                filename = f"{subdir}{os.path.sep}{f}"
+                if isArchive(f):
+                    if pattern != None and re.match(pattern, f):
+                        yield from archiveSources(filename, pattern)
+                    else:
+                        logger.warn(f"Skipping archive '{filename}' found in directory '{path}'. Pass the archive directly to read it.")
+                elif pattern == None or re.match(pattern, f):
+                    yield Source(filename)
@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+
+from .logger import LoggerFactory
+
+logger = LoggerFactory.getLogger(__name__)
+
+#-----------------------
+# Optimizer State
+#-----------------------
+class OptimizerState():
+    # The state of an optimizer run. For every agent and monitor type it stores a digest of the configurations the agent
+    # has, and for every slice (agent group and monitor type) the signature of the slice together with the search result.
+    # A slice whose signature did not change since the last run does not need to be searched again.
+    def __init__(self, section, settings):
+        # thresholds and monitoring configurations are optimized separately, each of them has its own section in the file
+        self.section = section
+        self.settings = settings
+
+        # state of the last run
+        self.agents = {}
+        self.slices = {}
+
+        # state of this run
+        self.currentAgents = {}
+        self.currentSlices = {}
+        self.signatures = {}
+        self.lookup = None
+
+    @staticmethod
+    def read(filename):
+        if not os.path.isfile(filename):
+            return {}
+
+        with open(filename) as fp:
+            content = json.load(fp)
+
+        if content["type"] != "OptimizerState":
+            raise RuntimeError(f"Optimizer state file is of incorrect type. Found \'{content['type']}\' expected 'OptimizerState'.")
+
+        return content["sections"]
+
+    @staticmethod
+    def load(filename, section, settings):
+        state = OptimizerState(section, settings)
+
+        sections = OptimizerState.read(filename)
+        if not section in sections:
+            logger.info(f"No optimizer state for {section} found in '{filename}'. Optimizing all slices.")
+            return state
+
+        if sections[section]["settings"] != settings:
+            logger.info(f"Optimizer settings changed since the state file '{filename}' was written. Optimizing all slices.")
+            return state
+
+        logger.info(f"Loading optimizer state for {section} from '{filename}' ...")
+        state.agents = sections[section]["agents"]
+        state.slices = sections[section]["slices"]
+
+        return state
+
+    def save(self, filename):
+        logger.info(f"Writing optimizer state for {self.section} to '{filename}' ...")
+
+        # keep the sections of the other configurations
+        sections = OptimizerState.read(filename)
+        sections[self.section] = {"settings": self.settings, "agents": self.currentAgents, "slices": self.currentSlices}
+
+        path = os.path.dirname(os.path.normpath(filename))
+        if path != "": os.makedirs(path, exist_ok = True)
+
+        with open(filename, 'w') as fp:
+            json.dump({"type": "OptimizerState", "sections": sections}, fp)
+
+    @staticmethod
+    def agentDigests(matrix, fingerprints):
+        # digest of the configurations of every agent, per monitor type
+        agents = {}
+        for column, agentId in enumerate(matrix.agents):
+            monitorTypes = {}
+            for id in matrix.configurationIds(column).tolist():
+                monitorTypes.setdefault(matrix.monitorTypes[id], []).append(fingerprints[id])
+
+            agents[agentId] = {monitorType: hashlib.sha1("\n".join(sorted(values)).encode()).hexdigest() for monitorType, values in monitorTypes.items()}
+
+        return agents
+
+    def update(self, agents):
+        self.currentAgents = agents
+
+        changed = len([agentId for agentId in agents if agentId in self.agents and agents[agentId] != self.agents[agentId]])
+        new = len([agentId for agentId in agents if not agentId in self.agents])
+        removed = len([agentId for agentId in self.agents if not agentId in agents])
+        logger.info(f"{changed} agent(s) changed, {new} agent(s) added and {removed} agent(s) removed since the last run.")
+
+    def signature(self, agentIds, monitorType):
+        # the signature only depends on the agents of the slice having configurations of the monitor type
+        digest = hashlib.sha1(monitorType.encode())
+        for agentId in sorted(agentIds):
+            if monitorType in self.currentAgents[agentId]:
+                digest.update(f"\n{agentId}={self.currentAgents[agentId][monitorType]}".encode())
+
+        return digest.hexdigest()
+
+    def getSlice(self, idx, signature, fingerprints):
+        # returns the stored search result of the slice or False if the slice changed. The result of a search which
+        # was stopped by the timeout is not reused, the slice is searched again.
+        self.signatures[idx] = signature
+
+        if not idx in self.slices or self.slices[idx]["signature"] != signature or not self.slices[idx].get("complete", False):
+            return False
+
+        found = self.slices[idx]["found"]
+        if found == None: return None
+        if found["baseConfigs"] == None: return (None, 0, 0, True)
+
+        if self.lookup == None:
+            self.lookup = {fingerprint: id for id, fingerprint in enumerate(fingerprints)}
+
+        # the ids are restored in the order of the combination the search returned
+        return (tuple([self.lookup[fingerprint] for fingerprint in found["baseConfigs"]]), found["numagents"], found["otherCount"], True)
+
+    def setSlice(self, idx, found, configIds, configurations):
+        if found == None:
+            stored = None
+        elif found[0] == None:
+            stored = {"baseConfigs": None, "numagents": 0, "otherCount": 0}
+        else:
+            # the configurations are kept in the order of the combination, so the base policy is generated in the same order when it is restored
+            stored = {"baseConfigs": [configurations[id].fingerprint() for id in found[0]], "numagents": int(found[1]), "otherCount": int(found[2])}
+
+        accepted = stored["baseConfigs"] if configIds != None else None
+        complete = found == None or found[3]
+        self.currentSlices[idx] = {"signature": self.signatures[idx], "found": stored, "accepted": accepted, "complete": complete}
+
+    def report(self):
+        # compare the base policies of this run with the ones of the last run
+        previous = {idx: sorted(slice["accepted"]) for idx, slice in self.slices.items() if slice["accepted"] != None}
+        current = {idx: sorted(slice["accepted"]) for idx, slice in self.currentSlices.items() if slice["accepted"] != None}
+
+        stable = [idx for idx in current if idx in previous and current[idx] == previous[idx]]
+        changed = [idx for idx in current if idx in previous and current[idx] != previous[idx]]
+        new = [idx for idx in current if not idx in previous]
+        removed = [idx for idx in previous if not idx in current]
+
+        logger.info(f"Base policies: {len(stable)} stable, {len(changed)} changed, {len(new)} new, {len(removed)} removed.")
+        for idx in changed: logger.info(f"Base policy '{idx}' changed.")
+        for idx in new: logger.info(f"Base policy '{idx}' added.")
+        for idx in removed: logger.info(f"Base policy '{idx}' removed.")
@@ -2,18 +2,30 @@ import csv
 import traceback
 import os
 import re
+import fnmatch
+import multiprocessing
+import pickle
+import hashlib
+import json
+
+from itertools import chain, islice
+from collections import deque
 
 from .logger import LoggerFactory
 from lib.configuration import InstanceThresholdConfiguration
+from lib.sources import Source, Sources
 
 logger = LoggerFactory.getLogger(__name__)
 
+# version of the threshold cache files. Must be changed whenever the parsing of the threshold files changes.
+CACHE_VERSION = 1
+
 #-----------------------
 # Thresholds
 #-----------------------
 class InstanceThresholdMigrator():
     def __init__(self, thresholds, kmRepository):
-        self.thresholds = thresholds.set
+        self.thresholds = thresholds
         self.kmRepository = kmRepository
 
         self.absoluteConditionMap = {
@@ -56,39 +68,78 @@ class InstanceThresholdMigrator():
         if value.lower() == "false": return False
         return True    
 
-    def migrate(self, force):
-        logger.info(f"Migrating {len(self.thresholds)} instance thresholds ...")
-        unknownMonitorTypes = []
+    def migrate(self, force, batchSize = 10000):
+        logger.info(f"Migrating instance thresholds ...")
+        self.unknownMonitorTypes = []
+        self.rejected = []
 
         configurations = []
-        
-        for threshold in self.thresholds:
-            try:
-                if not threshold["monitorType"] in self.kmRepository.monitors:
-                    if not threshold["monitorType"] in unknownMonitorTypes:
-                        logger.warn(f"Monitor {threshold['monitorType']} not found in repository.")
-                        unknownMonitorTypes.append(threshold["monitorType"])
+        count = 0
+
+        # the thresholds are migrated in batches while they are read
+        thresholds = iter(self.thresholds)
+        while True:
+            batch = list(islice(thresholds, batchSize))
+            if len(batch) == 0: break
+
+            count = count + len(batch)
+            configurations.extend(self.migrateBatch(batch, force))
+
+        logger.info(f"Migrated {len(configurations)} of {count} instance thresholds. {len(self.rejected)} instance threshold(s) rejected.")
+        return configurations
 
-                    if not force: continue
+    def migrateBatch(self, thresholds, force):
+        monitors = self.kmRepository.monitors
 
+        # translate the columns of the batch. Every distinct value is only translated once.
+        monitorTypes = [threshold["monitorType"] for threshold in thresholds]
+        solutions = self.translate(monitorTypes, lambda monitorType: monitors[monitorType]["solution"] if monitorType in monitors else "unknown")
+        releases = self.translate(monitorTypes, lambda monitorType: monitors[monitorType]["release"] if monitorType in monitors else "unknown")
+        attributes = self.translate([(threshold["monitorType"], threshold["attribute"]) for threshold in thresholds], lambda key: self.kmRepository.getRealName(*key))
+        comparisons = self.translate([(threshold["thresholdType"], threshold["condition"]) for threshold in thresholds],
+            lambda key: self.absoluteConditionMap[key[1]] if key[0] == "absolute" else self.conditionMap[key[1]])
+        baselines = self.translate([threshold["outsideBaseline"] for threshold in thresholds], lambda value: self.baselineMap[value] if value in self.baselineMap else "notEnabled")
+        autoCloses = self.translate([threshold["autoClose"] for threshold in thresholds], self.toBool)
+        predicts = self.translate([threshold["predict"] for threshold in thresholds], self.toBool)
+
+        configurations = []
+        for i, threshold in enumerate(thresholds):
+            if not monitorTypes[i] in monitors:
+                if not monitorTypes[i] in self.unknownMonitorTypes:
+                    logger.warn(f"Monitor {monitorTypes[i]} not found in repository.")
+                    self.unknownMonitorTypes.append(monitorTypes[i])
+
+                if not force: continue
+
+            # the row is rejected with the first error found in the order the values are needed
+            rejected = False
+            for (value, error, trace) in [solutions[i], releases[i], attributes[i], autoCloses[i], comparisons[i], baselines[i], predicts[i]]:
+                if error != None:
+                    self.reject(threshold, error, trace)
+                    rejected = True
+                    break
+
+            if rejected: continue
+
+            try:
                 configurations.append(InstanceThresholdConfiguration(
                     agent = threshold["agent"],
                     port = threshold["port"],
-                    solution = self.kmRepository.monitors[threshold["monitorType"]]["solution"] if threshold["monitorType"] in self.kmRepository.monitors else "unknown",
-                    release = self.kmRepository.monitors[threshold["monitorType"]]["release"] if threshold["monitorType"] in self.kmRepository.monitors else "unknown",
-                    monitorType = threshold["monitorType"],
+                    solution = solutions[i][0],
+                    release = releases[i][0],
+                    monitorType = monitorTypes[i],
                     device = threshold["device"],
-                    attribute = self.kmRepository.getRealName(threshold["monitorType"], threshold["attribute"]),
+                    attribute = attributes[i][0],
 
                     # Details
                     absoluteDeviation = threshold["absoluteDeviation"],
-                    autoClose = self.toBool(threshold["autoClose"]),
-                    comparison = self.absoluteConditionMap[threshold["condition"]] if threshold["thresholdType"] == "absolute" else self.conditionMap[threshold["condition"]] ,
+                    autoClose = autoCloses[i][0],
+                    comparison = comparisons[i][0],
                     durationInMins = threshold["duration"],
                     minimumSamplingWindow = threshold["minSampleWindow"],
-                    outsideBaseline = self.baselineMap[threshold["outsideBaseline"]] if threshold["outsideBaseline"] in self.baselineMap else "notEnabled",
+                    outsideBaseline = baselines[i][0],
                     percentDeviation = threshold["deviation"],
-                    predict = self.toBool(threshold["predict"]),
+                    predict = predicts[i][0],
                     severity = threshold["severity"],
                     threshold = threshold["value"],
 
@@ -97,86 +148,281 @@ class InstanceThresholdMigrator():
                     type = threshold["thresholdType"]
                 ))
             except Exception as error:
-                logger.error("An unexpected exception occured while migrating instance threshold. Continuing processing but entry is ignored.")
-                logger.error(f"agent: {threshold['agent']}")
-                logger.error(f"port: {threshold['port']}")
-                logger.error(f"monitorType: {threshold['monitorType']}")
-                logger.error(f"attribute: {threshold['attribute']}")
-                logger.error(f"instance: {threshold['instance']}")
-                logger.error(f"type: {threshold['thresholdType']}")
-                logger.error(f"condition: {threshold['condition']}")
-                logger.error(f"error: {error}")
-                logger.debug(traceback.format_exc())
+                self.reject(threshold, error, traceback.format_exc())
 
         return configurations
 
+    def translate(self, values, function):
+        # returns (value, error, traceback) for every value
+        table = {}
+        for value in set(values):
+            try:
+                table[value] = (function(value), None, None)
+            except Exception as error:
+                table[value] = (None, error, traceback.format_exc())
+
+        return [table[value] for value in values]
+
+    def reject(self, threshold, error, trace):
+        self.rejected.append((threshold, str(error)))
+
+        logger.error("An unexpected exception occured while migrating instance threshold. Continuing processing but entry is ignored.")
+        logger.error(f"agent: {threshold['agent']}")
+        logger.error(f"port: {threshold['port']}")
+        logger.error(f"monitorType: {threshold['monitorType']}")
+        logger.error(f"attribute: {threshold['attribute']}")
+        logger.error(f"instance: {threshold['instance']}")
+        logger.error(f"type: {threshold['thresholdType']}")
+        logger.error(f"condition: {threshold['condition']}")
+        logger.error(f"error: {error}")
+        logger.debug(trace)
+
+class ThresholdFilter():
+    # Selects the thresholds to be migrated. Agents are matched by name or by name and port and can contain
+    # wildcards (e.g. 'web*' or '*:3181'). The filter is applied to the rows of the file before they are converted.
+    def __init__(self, agents = None, monitorTypes = None, severities = None):
+        self.patterns = agents
+        self.agents = re.compile("|".join([fnmatch.translate(agent.lower()) for agent in agents])) if agents else None
+        self.monitorTypes = set(monitorTypes) if monitorTypes else None
+        self.severities = set([severity.upper() for severity in severities]) if severities else None
+
+    def matches(self, row):
+        if self.monitorTypes != None and not row[1] in self.monitorTypes: return False
+        if self.severities != None and not row[5].upper() in self.severities: return False
+        if self.agents != None:
+            agentId = row[0].lower()
+            if not self.agents.match(agentId) and not self.agents.match(agentId.split(':')[0]): return False
+
+        return True
+
+    def __str__(self):
+        return ", ".join([f"{name}: {', '.join(sorted(values))}" for name, values in [("agents", self.patterns if self.agents else None),
+            ("monitor types", self.monitorTypes), ("severities", self.severities)] if values != None])
+
+class ThresholdRow():
+    # A threshold read from a threshold file. The fields can be accessed like the keys of a dict (threshold["agent"]).
+    __slots__ = ["agent", "port", "monitorType", "device", "instance", "attribute", "severity", "duration", "condition", "value", "uom",
+        "outsideBaseline", "autoClose", "predict", "minSampleWindow", "baselineType", "absoluteDeviation", "deviation", "suppressEvents", "thresholdType"]
+
+    def __init__(self, agent, port, monitorType, device, instance, attribute, severity, duration, condition, value, uom,
+            outsideBaseline, autoClose, predict, minSampleWindow, baselineType, absoluteDeviation, deviation, suppressEvents, thresholdType):
+        self.agent = agent
+        self.port = port
+        self.monitorType = monitorType
+        self.device = device
+        self.instance = instance
+        self.attribute = attribute
+        self.severity = severity
+        self.duration = duration
+        self.condition = condition
+        self.value = value
+        self.uom = uom
+        self.outsideBaseline = outsideBaseline
+        self.autoClose = autoClose
+        self.predict = predict
+        self.minSampleWindow = minSampleWindow
+        self.baselineType = baselineType
+        self.absoluteDeviation = absoluteDeviation
+        self.deviation = deviation
+        self.suppressEvents = suppressEvents
+        self.thresholdType = thresholdType
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return repr({key: self[key] for key in self.__slots__})
+
 class ThresholdSet():
     def __init__(self):
         self.set = []
 
+    def __iter__(self):
+        return iter(self.set)
+
         
 class FileThresholdSet(ThresholdSet):
-    def __init__(self, filenames, extension):
+    # Iterating the set reads the threshold files row by row and only the rows passing the filter are converted.
+    # load() reads all the thresholds into self.set at once.
+    def __init__(self, filenames, extension, thresholdFilter = None, workers = 1, cacheDir = None):
         self.set = []
         self.filenames = filenames
         self.extension = extension
+        self.filter = thresholdFilter
+        self.workers = workers
+        self.cacheDir = cacheDir
+        self.loaded = False
+
+    def __iter__(self):
+        if self.loaded: return iter(self.set)
+
+        if self.filter != None: logger.info(f"Filtering thresholds ({self.filter}).")
+        if self.workers > 1: return self.readParallel(self.files())
+
+        return chain.from_iterable(self.read(source) for source in self.files())
+
+    def readParallel(self, sources):
+        # The files are parsed by a pool of processes while they are listed. Members of an archive are read by this
+        # process while the archive is open, so the archive is only read once. The thresholds are returned in the
+        # order of the files.
+        logger.info(f"Loading threshold files using {self.workers} processes ...")
+
+        # the workers get a reader of their own, the thresholds loaded so far are not sent to them
+        reader = FileThresholdSet([], self.extension, self.filter, cacheDir = self.cacheDir)
+        with multiprocessing.Pool(self.workers) as pool:
+            pending = deque()
+            for source in sources:
+                pending.append(pool.apply_async(reader.readFile, (source.detach(),)))
+
+                # keep a bounded number of files in flight
+                if len(pending) >= self.workers * 2:
+                    yield from pending.popleft().get()
+
+            while pending:
+                yield from pending.popleft().get()
+
+    def readFile(self, source):
+        return list(self.read(source))
+
+    def files(self):
+        # plain files and the members of archives
+        pattern = re.compile(f".*\.{self.extension}")
+        for filename in self.filenames:
+            yield from Sources(filename, pattern)
 
     def load(self, filename = None):
         if (filename == None):
-            for filename in self.filenames:
+            self.set.extend(self)
+            self.loaded = True
 
-                if os.path.isfile(filename):
-                    self.load(filename)
+        else:
+            self.set.extend(self.read(filename if isinstance(filename, Source) else Source(filename)))
 
-                elif os.path.isdir(filename):
-                    pattern = re.compile(f".*\.{self.extension}")
+    def read(self, source):
+        if self.cacheDir == None:
+            yield from self.parse(source)
+            return
 
-                    for subdir, dirs, files in os.walk(filename):
-                        for f in files:
-                            if re.match(pattern, f):
-                                self.load(f"{subdir}{os.path.sep}{f}")
+        # The cache file of a source is replaced whenever the source changes. The cache only holds files which were read
+        # completely, files with errors are always parsed again so the errors are logged.
+        (filename, key) = self.cacheKey(source)
+        cached = self.readCache(filename, key, source)
+        if cached != None:
+            logger.info(f"Loading Server Thresholds from '{source}' (cached) ...")
+            for values in cached:
+                yield ThresholdRow(*values)
 
-        else:
-            logger.info(f"Loading Server Thresholds from '{filename}' ...")
-            with open(filename) as input:
-                reader = csv.reader(input)
-                rowno = 0 
-                for row in reader:
-                    # skip header
-                    if rowno == 0:
-                        if len(row) != 20:
-                            logger.warn(f"File does not seam to be an exported server threshold file. Number of columns found is {len(row)} expected 20. Skipping file.")
-                            break
-
-                        if row[0] == "PATROL Agent" and row[1] == "Monitor Type": continue
-                    
-                    if row[19].lower() == "false":
-                        try: 
-                            self.set.append({
-                                "agent": row[0].split(':')[0],
-                                "port": row[0].split(':')[1],
-                                "monitorType": row[1],
-                                "device": row[2],
-                                "instance": row[3],
-                                "attribute": row[4],
-                                "severity": row[5].upper(),
-                                "duration": row[6],
-                                "condition": row[7],
-                                "value": row[8],
-                                "uom": row[9],
-                                "outsideBaseline": row[10],
-                                "autoClose": row[11],
-                                "predict": row[12],
-                                "minSampleWindow": row[13] if row[13] != "" else None,
-                                "baselineType": row[14],
-                                "absoluteDeviation": row[15] if row[15] != "" else None,
-                                "deviation": row[16],
-                                "suppressEvents": row[17],
-                                "thresholdType": row[18].lower()
-                            })
-                        except Exception as error:
-                            logger.error(f"An error occrued while processing row {rowno} of file {filename}. Skipping rest of file.")
-                            logger.error(error)
-                            break
-
-                    rowno = rowno + 1
+            return
+
+        thresholds = []
+        parser = self.parse(source)
+        while True:
+            try:
+                threshold = next(parser)
+            except StopIteration as stop:
+                complete = stop.value
+                break
+
+            thresholds.append(tuple(threshold[key] for key in ThresholdRow.__slots__))
+            yield threshold
+
+        if complete:
+            self.writeCache(filename, key, thresholds, source)
+
+    def readCache(self, filename, key, source):
+        # returns the cached thresholds of the source or None. A cache entry which is stale or can't be read is removed.
+        if not os.path.isfile(filename): return None
+
+        try:
+            with open(filename, "rb") as fp:
+                if pickle.load(fp) == key:
+                    return pickle.load(fp)
+
+            logger.info(f"Cache entry '{filename}' of '{source}' is stale. Parsing the file.")
+
+        except Exception as error:
+            logger.warn(f"Cache entry '{filename}' of '{source}' can't be read ({error}). Parsing the file.")
+
+        try:
+            os.remove(filename)
+        except OSError as error:
+            logger.warn(f"Cache entry '{filename}' can't be removed ({error}).")
+
+        return None
+
+    def writeCache(self, filename, key, thresholds, source):
+        # the migration doesn't depend on the cache, a cache entry which can't be written is skipped
+        tmpFilename = f"{filename}.tmp{os.getpid()}"
+        try:
+            os.makedirs(self.cacheDir, exist_ok = True)
+            with open(tmpFilename, "wb") as fp:
+                pickle.dump(key, fp)
+                pickle.dump(thresholds, fp, protocol = pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmpFilename, filename)
+
+        except Exception as error:
+            logger.warn(f"Thresholds of '{source}' can't be written to the cache '{self.cacheDir}' ({error}).")
+            if os.path.isfile(tmpFilename): os.remove(tmpFilename)
+
+    def cacheKey(self, source):
+        # the name of the cache file depends on the source and the filter, the key on the state of the source
+        stat = source.stat()
+        name = json.dumps([os.path.abspath(source.archive if source.archive != None else source.filename), source.member, str(self.filter) if self.filter else None])
+
+        return f"{self.cacheDir}{os.path.sep}{hashlib.sha1(name.encode()).hexdigest()}.pickle", [CACHE_VERSION, stat.st_size, stat.st_mtime_ns]
+
+    def parse(self, source):
+        # yields the thresholds of the file and returns True if the whole file was read
+        logger.info(f"Loading Server Thresholds from '{source}' ...")
+
+        # repeated values of the file share one string
+        values = {}
+        intern = lambda value: values.setdefault(value, value)
+        with source.open() as input:
+            reader = csv.reader(input)
+            rowno = 0 
+            for row in reader:
+                # skip header
+                if rowno == 0:
+                    if len(row) != 20:
+                        logger.warn(f"File does not seam to be an exported server threshold file. Number of columns found is {len(row)} expected 20. Skipping file.")
+                        return False
+
+                    if row[0] == "PATROL Agent" and row[1] == "Monitor Type": continue
+                
+                if row[19].lower() == "false" and (self.filter == None or self.filter.matches(row)):
+                    try: 
+                        agent = row[0].split(':')
+                        threshold = ThresholdRow(
+                            intern(agent[0]),
+                            intern(agent[1]),
+                            intern(row[1]),
+                            intern(row[2]),
+                            intern(row[3]),
+                            intern(row[4]),
+                            intern(row[5].upper()),
+                            intern(row[6]),
+                            intern(row[7]),
+                            intern(row[8]),
+                            intern(row[9]),
+                            intern(row[10]),
+                            intern(row[11]),
+                            intern(row[12]),
+                            intern(row[13]) if row[13] != "" else None,
+                            intern(row[14]),
+                            intern(row[15]) if row[15] != "" else None,
+                            intern(row[16]),
+                            intern(row[17]),
+                            intern(row[18].lower())
+                        )
+                    except Exception as error:
+                        logger.error(f"An error occrued while processing row {rowno} of file {source}. Skipping rest of file.")
+                        logger.error(error)
+                        return False
+
+                    yield threshold
+
+                rowno = rowno + 1
+
+        return True